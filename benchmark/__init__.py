@@ -0,0 +1,18 @@
+import asyncio
+import time
+
+
+async def measure(func, iterations: int = 10000) -> float:
+    """Await func() iterations times and return the mean duration in microseconds."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - start) / iterations * 1000000
+
+
+def report(name: str, before: float, after: float):
+    print(f"{name}: before={before:.2f}us after={after:.2f}us speedup={before / after:.2f}x")
+
+
+def run(main):
+    asyncio.run(main())
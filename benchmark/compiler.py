@@ -0,0 +1,159 @@
+"""
+Cold start of an application with 50 controllers, 20 event subscribers and 50 services, from creating the kernel to
+the first response, with and without the compiled container. Every run is a new process.
+
+Run with: python -m microapi.benchmark.compiler
+"""
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+
+from . import report, run
+from ..compiler import ContainerCompiler
+from ..kernel import HttpKernel
+
+_package = __package__.split(".")[0]
+
+_app = f"""
+from {_package}.config import FrameworkServiceProvider
+from {_package}.di import ServiceProvider, tag
+from {_package}.event import listen
+from {_package}.kernel import RequestEvent, ResponseEvent
+from {_package}.router import route
+
+
+class Service0:
+    pass
+"""
+
+_service = """
+
+class Service{i}:
+    def __init__(self, dependency: Service{previous}):
+        self.dependency = dependency
+"""
+
+_controller = """
+
+@tag('controller')
+class Controller{i}:
+    def __init__(self, service: Service{service}):
+        self.service = service
+{actions}
+"""
+
+_action = """
+    @route('/resource{i}/{{id}}/action{j}')
+    async def action{j}(self, id: str):
+        return {{"id": id}}
+"""
+
+_subscriber = """
+
+@tag('event_subscriber')
+class Subscriber{i}:
+    @listen(RequestEvent, {i})
+    async def request(self, event):
+        pass
+
+    @listen(ResponseEvent, {i})
+    async def response(self, event):
+        pass
+"""
+
+_providers = """
+
+class AppServiceProvider(ServiceProvider):
+    def services(self):
+        yield from SERVICES
+
+
+SERVICES = [{services}]
+
+
+def service_providers():
+    yield FrameworkServiceProvider()
+    yield AppServiceProvider()
+"""
+
+_child = f"""
+import asyncio, logging, sys, time
+logging.disable(logging.INFO)
+import cold_start_app
+from {_package}.compiler import load
+from {_package}.http import Request
+from {_package}.kernel import HttpKernel
+
+
+async def main():
+    start = time.perf_counter()
+    kernel = HttpKernel(service_providers=cold_start_app.service_providers())
+    if sys.argv[1] == "compiled":
+        import cold_start_compiled
+        assert load(kernel.container, cold_start_compiled)
+    response = await kernel.handle(Request("http://localhost/resource49/1/action9"))
+    assert response.status_code == 200
+    print((time.perf_counter() - start) * 1000000)
+
+asyncio.run(main())
+"""
+
+
+def create_app(services: int = 50, controllers: int = 50, actions: int = 10, subscribers: int = 20) -> str:
+    """Return the source of an application module, the services depend on each other in a chain."""
+    parts = [_app]
+    parts += [_service.format(i=i, previous=i - 1) for i in range(1, services)]
+    for i in range(controllers):
+        parts.append(_controller.format(
+            i=i,
+            service=services - 1,
+            actions="".join(_action.format(i=i, j=j) for j in range(actions))
+        ))
+    parts += [_subscriber.format(i=i) for i in range(subscribers)]
+    names = [f"Service{i}" for i in range(services)]
+    names += [f"Controller{i}" for i in range(controllers)]
+    names += [f"Subscriber{i}" for i in range(subscribers)]
+    parts.append(_providers.format(services=", ".join(names)))
+    return "".join(parts)
+
+
+def cold_start(directory: str, variant: str) -> float:
+    """Start a new process and return its cold start in microseconds."""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([directory, root])}
+    result = subprocess.run(
+        [sys.executable, "-c", _child, variant],
+        cwd=directory, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout)
+
+
+async def main(runs: int = 20):
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "cold_start_app.py"), "w", encoding="utf-8") as f:
+            f.write(create_app())
+
+        sys.path.insert(0, directory)
+        try:
+            import cold_start_app
+            kernel = HttpKernel(service_providers=cold_start_app.service_providers())
+            ContainerCompiler(kernel.container).write(os.path.join(directory, "cold_start_compiled.py"))
+        finally:
+            sys.path.remove(directory)
+
+        # Deployments import both modules from bytecode, do not measure compiling their source
+        compileall.compile_dir(directory, quiet=1)
+
+        before = []
+        after = []
+        for _ in range(runs):
+            before.append(cold_start(directory, "reflection"))
+            after.append(cold_start(directory, "compiled"))
+
+    report("Cold start (50 controllers, 20 subscribers)", sum(before) / runs, sum(after) / runs)
+
+
+if __name__ == "__main__":
+    run(main)
@@ -0,0 +1,97 @@
+"""
+Per-request DI overhead of resolving the controller from test.py, compared to the former container.
+
+Run with: python -m microapi.benchmark.di
+"""
+import copy
+import inspect
+
+from . import measure, report, run
+from ..di import Container
+from ..http import Request
+from ..util import call_async
+
+
+class MyService:
+    def __init__(self, request: Request):
+        self.request = request
+
+    async def do_something(self, data):
+        return f"{data} {self.request.attributes}"
+
+
+class MyController:
+    async def action(self, data: str, service: MyService):
+        some_data = await service.do_something(data)
+        return {
+            "some": some_data,
+            "and": "other_data"
+        }
+
+
+class BaselineContainer:
+    """The container before injection plans and child scopes, it copied its services for every scope."""
+    def __init__(self, services=None):
+        self._services = services or {}
+        self._instances = {}
+        self.set(BaselineContainer, self)
+
+    def set(self, name, provider=None):
+        self._services[name] = provider
+
+    def build(self):
+        return BaselineContainer(copy.deepcopy(self._services))
+
+    async def has(self, name):
+        return name in self._services
+
+    async def get(self, name):
+        if name in self._instances:
+            return self._instances[name]
+        if not await self.has(name):
+            raise ValueError(f"Service '{name}' not found")
+        provider = self._services.get(name)
+        if provider is None:
+            async def provider(_):
+                return await _.call(name)
+        instance = await call_async(provider, self) if callable(provider) else provider
+        self._instances[name] = instance
+        return instance
+
+    async def call(self, func, args_dict=None):
+        if args_dict is None:
+            args_dict = {}
+        resolved_args = {}
+        for param_name, param in inspect.signature(func).parameters.items():
+            if param_name in args_dict:
+                resolved_args[param_name] = args_dict[param_name]
+            elif param.annotation is not inspect.Parameter.empty:
+                if not await self.has(param.annotation):
+                    raise RuntimeError(f"Argument '{param_name}' has no registered service '{param.annotation}'")
+                resolved_args[param_name] = await self.get(param.annotation)
+        return await call_async(func, **resolved_args)
+
+
+async def main():
+    request = Request("http://localhost/some/data", attributes={"data": "data"})
+
+    def handler(container):
+        container.set(MyController)
+        container.set(MyService)
+
+        async def handle():
+            scoped = container.build()
+            scoped.set(Request, request)
+            controller = await scoped.get(MyController)
+            return await scoped.call(controller.action, request.attributes)
+        return handle
+
+    before = handler(BaselineContainer())
+    after = handler(Container())
+    assert await before() == await after()
+
+    report("Container.call", await measure(before), await measure(after))
+
+
+if __name__ == "__main__":
+    run(main)
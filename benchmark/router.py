@@ -0,0 +1,62 @@
+"""
+Matching cost of the router with 1,000 routes, compared to the former linear regex matching.
+
+Run with: python -m microapi.benchmark.router
+"""
+from . import measure, report, run
+from ..di import Container, tag
+from ..http import Request
+from ..router import Router, route
+
+
+def create_controllers(count: int = 100, routes_per_controller: int = 10):
+    controllers = []
+    for i in range(count):
+        methods = {}
+        for j in range(routes_per_controller):
+            async def action(self, **kwargs):
+                pass
+            methods[f"action{j}"] = route(f"/resource{i}/{{id}}/action{j}")(action)
+        controllers.append(tag('controller')(type(f"Controller{i}", (object,), methods)))
+    return controllers
+
+
+def linear_match(router: Router, request: Request):
+    """The matching algorithm before routes were compiled to trees."""
+    for http_method, regex, cls, method_name, param_names in router.routes():
+        if request.method != http_method:
+            continue
+        match = regex.match(request.path)
+        if match:
+            return cls, method_name, {name: match.group(name) for name in param_names}
+    return None
+
+
+async def main():
+    container = Container()
+    for cls in create_controllers():
+        container.set(cls)
+    router = Router(container.tagged_generator('controller'))
+    requests = [
+        Request("http://localhost/resource0/1/action0"),
+        Request("http://localhost/resource50/2/action5"),
+        Request("http://localhost/resource99/3/action9"),
+        Request("http://localhost/missing/4"),
+    ]
+
+    async def before():
+        for request in requests:
+            linear_match(router, request)
+
+    async def after():
+        for request in requests:
+            router.match(request)
+
+    for request in requests:
+        assert linear_match(router, request) == router.match(request)
+
+    report("Router.match (1000 routes, 4 requests)", await measure(before, 20), await measure(after, 2000))
+
+
+if __name__ == "__main__":
+    run(main)
@@ -52,3 +52,7 @@ class CloudContext:
 
     async def raw(self) -> dict:
         return {}
+
+    async def wait_until(self, coroutine):
+        """Keep running a coroutine after the response was sent. Without runtime support it is awaited directly."""
+        await coroutine
@@ -0,0 +1,100 @@
+from asyncio import ensure_future, wait
+
+from .http import RequestConverter as BridgeRequestConverter, ResponseConverter as BridgeResponseConverter
+from ..inmemory import CloudContext, TaskTracker
+from ..inmemory.http import ClientExecutor as BridgeClientExecutor
+from ..inmemory.http.server import CronScheduler
+from ...bridge import CloudContext as FrameworkCloudContext, RequestConverter, ResponseConverter
+from ...di import Container, ServiceProvider, Lifetime
+from ...http import ClientExecutor
+from ...kernel import HttpKernel as FrameworkHttpKernel
+from ...util import logger, exception_traceback
+
+
+class App(ServiceProvider):
+    """ASGI 3 application, run it with any ASGI server, e.g. `uvicorn main:app`."""
+
+    def __init__(
+            self,
+            kernel: FrameworkHttpKernel = None,
+            container: Container = None,
+            service_providers = None,
+            cron_interval: int = None,
+            drain_timeout: int = 30
+    ):
+        if kernel is not None and (container is not None or service_providers is not None):
+            raise RuntimeError("cannot pass both kernel and container or service_providers")
+
+        if kernel is None:
+            kernel = FrameworkHttpKernel(container=container, service_providers=service_providers)
+
+        self.kernel = kernel
+        self.container = kernel.container
+        self.tasks = TaskTracker()
+        self.cron_interval = cron_interval
+        self.drain_timeout = drain_timeout
+        self._cron = None
+        self._cron_scheduler = None
+        self.container.provide(self)
+
+    def services(self):
+        yield ClientExecutor, lambda _: BridgeClientExecutor(), Lifetime.SINGLETON
+        yield FrameworkCloudContext, lambda _: CloudContext(self.tasks)
+        yield RequestConverter, lambda _: BridgeRequestConverter(), Lifetime.SINGLETON
+        yield ResponseConverter, lambda _: BridgeResponseConverter(), Lifetime.SINGLETON
+
+    async def container_builder(self, _: Container):
+        _.set(FrameworkCloudContext, lambda _: CloudContext(self.tasks))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        else:
+            raise NotImplementedError(f"ASGI scope type '{scope['type']}' is not supported")
+
+    async def http(self, scope, receive, send):
+        request_converter = await self.container.get(RequestConverter)
+        response_converter = await self.container.get(ResponseConverter)
+        request = await request_converter.to_microapi((scope, receive))
+        response = await self.kernel.handle(request, self.container_builder)
+        async for message in await response_converter.from_microapi(response):
+            await send(message)
+
+    async def startup(self):
+        await self.kernel.boot()
+        if self.cron_interval is not None:
+            self._cron_scheduler = CronScheduler(self, self.container_builder, interval=self.cron_interval)
+            self._cron = ensure_future(self._cron_scheduler.run())
+
+    async def shutdown(self):
+        if self._cron is not None:
+            # A cron task in progress is finished first
+            self._cron_scheduler.stop()
+            _, pending = await wait([self._cron], timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            self._cron = None
+        await self.tasks.drain(self.drain_timeout)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger(__name__).error(f"Startup failed: {exception_traceback(e)}")
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                try:
+                    await self.shutdown()
+                except Exception as e:
+                    logger(__name__).error(f"Shutdown failed: {exception_traceback(e)}")
+                    await send({"type": "lifespan.shutdown.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -0,0 +1,80 @@
+from typing import Any, AsyncIterator
+
+from ....bridge import RequestConverter as BridgeRequestConverter, ResponseConverter as BridgeResponseConverter
+from ....http import Request, Response, StreamingResponse
+
+
+class AsgiRequest(Request):
+    """Request streaming its body from the ASGI receive channel as it is consumed."""
+
+    def __init__(self, scope: dict, receive):
+        headers = {}
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1")
+            value = value.decode("latin-1")
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+        host = headers.get("host")
+        if host is None and scope.get("server"):
+            host = "%s:%s" % tuple(scope["server"])
+        path = scope.get("root_path", "") + scope["path"]
+        query = scope.get("query_string", b"").decode("latin-1")
+        url = f"{scope.get('scheme', 'http')}://{host or 'localhost'}{path}" + (f"?{query}" if query else "")
+
+        super().__init__(
+            url=url,
+            method=scope["method"],
+            headers=headers,
+            stream=self._receive_body(receive),
+            client_ip=scope["client"][0] if scope.get("client") else None
+        )
+
+    @staticmethod
+    async def _receive_body(receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ConnectionError("Client disconnected while sending the request body")
+            if message.get("body"):
+                yield message["body"]
+            if not message.get("more_body", False):
+                return
+
+
+class RequestConverter(BridgeRequestConverter):
+    async def to_microapi(self, _: tuple[dict, Any]) -> Request:
+        scope, receive = _
+        return AsgiRequest(scope, receive)
+
+    async def from_microapi(self, _: Request) -> Any:
+        raise NotImplementedError()
+
+
+class ResponseConverter(BridgeResponseConverter):
+    async def to_microapi(self, _: Any) -> Response:
+        raise NotImplementedError()
+
+    async def from_microapi(self, _: Response) -> AsyncIterator[dict]:
+        """Return the ASGI messages sending the response, streaming responses are sent chunk by chunk."""
+        headers = [
+            (name.lower().encode("latin-1"), str(value).encode("latin-1"))
+            for name, value in _.headers.items()
+            if name.lower() != "content-length"
+        ]
+
+        async def messages():
+            if isinstance(_, StreamingResponse):
+                yield {"type": "http.response.start", "status": _.status_code, "headers": headers}
+                async for chunk in _.stream():
+                    yield {"type": "http.response.body", "body": chunk, "more_body": True}
+                yield {"type": "http.response.body", "body": b""}
+                return
+
+            body = await _.body()
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            yield {"type": "http.response.start", "status": _.status_code, "headers": headers}
+            yield {"type": "http.response.body", "body": body}
+
+        return messages()
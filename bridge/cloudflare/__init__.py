@@ -1,4 +1,6 @@
+from asyncio import ensure_future
 from typing import Any
+from pyodide.ffi import create_proxy
 from workers import WorkflowEntrypoint, WorkerEntrypoint, Response
 
 from .http import RequestConverter as BridgeRequestConverter, RequestConverter, ResponseConverter
@@ -8,8 +10,9 @@ from .queue import Queue, MessageBatchConverter
 from .sql import Database
 from .util import to_py
 from .workflow import WorkflowManagerFactory as BridgeWorkflowManagerFactory
+from ...compiler import load as load_compiled
 from ...config import FrameworkServiceProvider
-from ...di import Container, ServiceProvider
+from ...di import Container, ServiceProvider, Lifetime
 from ...bridge import CloudContext as FrameworkCloudContext
 from ...kernel import HttpKernel as FrameworkHttpKernel
 from ...http import ClientExecutor
@@ -35,6 +38,12 @@ class CloudContext(FrameworkCloudContext):
     async def raw(self) -> dict:
         return self._raw
 
+    async def wait_until(self, coroutine):
+        if self._raw["context"] is None:
+            await coroutine
+            return
+        self._raw["context"].waitUntil(create_proxy(ensure_future(coroutine)))
+
     async def config(self, path:str, default=None):
         config = self._raw["config"] or {}
         return from_dict(config, path, default)
@@ -132,9 +141,9 @@ class App(ServiceProvider):
         ]
 
     def services(self):
-        yield RequestConverter, lambda _: BridgeRequestConverter()
-        yield ResponseConverter, lambda _: BridgeResponseConverter()
-        yield ClientExecutor, lambda _: BridgeClientExecutor()
+        yield RequestConverter, lambda _: BridgeRequestConverter(), Lifetime.SINGLETON
+        yield ResponseConverter, lambda _: BridgeResponseConverter(), Lifetime.SINGLETON
+        yield ClientExecutor, lambda _: BridgeClientExecutor(), Lifetime.SINGLETON
         yield WorkflowManagerFactory, lambda _: BridgeWorkflowManagerFactory(_)
 
     def on_fetch(self):
@@ -223,8 +232,16 @@ class FrameworkAppFactory:
     def config(self):
         return {}
 
+    def compiled(self):
+        """Return the module generated by microapi.compiler for the service providers, if any."""
+        return None
+
     def create(self) -> App:
-        return App(service_providers=self.service_providers(), config=self.config())
+        kernel = FrameworkHttpKernel(service_providers=self.service_providers())
+        compiled = self.compiled()
+        if compiled is not None:
+            load_compiled(kernel.container, compiled)
+        return App(kernel=kernel, config=self.config())
 
 
 class FrameworkEntrypoint(WorkerEntrypoint):
@@ -1,11 +1,11 @@
-import json
 from urllib.parse import urlunparse
-from js import fetch, Response, Object
+from asyncio import ensure_future
+from js import fetch, Response, Object, TransformStream
 from workers import Response as CloudflareResponse, Request as CloudflareRequest
 
 from ....bridge import RequestConverter as BridgeRequestConverter, ResponseConverter as BridgeResponseConverter
-from ..util import to_py, to_js
-from ....http import Request, Response, ClientRequest, ClientResponse as FrameworkClientResponse, \
+from ..util import to_py, to_js, to_array_buffer
+from ....http import Request, Response, StreamingResponse, ClientRequest, ClientResponse as FrameworkClientResponse, \
     ClientExecutor as FrameworkClientExecutor, Headers
 
 
@@ -19,15 +19,27 @@ class FrameworkCloudflareRequest(Request):
             value = to_py(_request.headers.get(item))
             headers[name.lower()] = value
 
-        super().__init__(url=url, method=method, headers=headers)
-        self._body = None
+        # Cloudflare overwrites a CF-Connecting-IP header sent by the client
+        super().__init__(
+            url=url,
+            method=method,
+            headers=headers,
+            stream=self._read_body(_request),
+            client_ip=headers.get("cf-connecting-ip")
+        )
         self._request = _request
 
-    async def body(self):
-        if self._body is not None:
-            return self._body
-        self._body = to_py(await self._request.text())
-        return self._body
+    @staticmethod
+    async def _read_body(_request):
+        """Read the chunks of the ReadableStream of the request as they arrive."""
+        if _request.body is None:
+            return
+        reader = _request.body.getReader()
+        while True:
+            result = await reader.read()
+            if result.done:
+                return
+            yield result.value.to_bytes()
 
 
 class RequestConverter(BridgeRequestConverter):
@@ -38,12 +50,44 @@ class RequestConverter(BridgeRequestConverter):
         raise NotImplementedError()
 
 
+# The Response constructor throws if these are given a body, even an empty one
+_null_body_statuses = (101, 103, 204, 205, 304)
+
+
 class ResponseConverter(BridgeResponseConverter):
+    def __init__(self):
+        self._pumps = set()
+
     async def to_microapi(self, _: CloudflareResponse) -> Response:
         raise NotImplementedError()
 
     async def from_microapi(self, _: Response) -> CloudflareResponse:
-        return CloudflareResponse(await _.body(), _.status_code, headers=_.headers.as_dict())
+        if _.status_code in _null_body_statuses:
+            return CloudflareResponse(None, _.status_code, headers=_.headers.as_dict())
+        if isinstance(_, StreamingResponse):
+            return CloudflareResponse(self.readable_stream(_), _.status_code, headers=_.headers.as_dict())
+        body = await _.body()
+        return CloudflareResponse(to_array_buffer(body) if body else None, _.status_code, headers=_.headers.as_dict())
+
+    def readable_stream(self, _: StreamingResponse):
+        """Pipe the chunks of a streaming response into the writable side of a TransformStream."""
+        stream = TransformStream.new()
+        writer = stream.writable.getWriter()
+
+        async def pump():
+            try:
+                async for chunk in _.stream():
+                    await writer.write(to_js(memoryview(chunk)))
+                await writer.close()
+            except Exception as e:
+                await writer.abort(str(e))
+
+        # The runtime keeps the request alive while the readable side is consumed,
+        # only keep a reference so the task is not garbage collected
+        task = ensure_future(pump())
+        self._pumps.add(task)
+        task.add_done_callback(self._pumps.discard)
+        return stream.readable
 
 
 class ClientResponse(FrameworkClientResponse):
@@ -54,26 +98,13 @@ class ClientResponse(FrameworkClientResponse):
             headers[to_py(k).lower()] = to_py(v)
         self.headers = Headers.create_from(headers)
         self.status_code = to_py(response.status)
-        self._body = response
-        self._cached = False
-        self._cache_body = None
-
-    async def json(self):
-        if self._cached:
-            return json.loads(self._cache_body)
-        proxy = await self._body.json()
-        data = to_py(proxy)
-        self._cached = True
-        self._cache_body = json.dumps(data)
-        return data
-
-    async def body(self):
-        if self._cached:
-            return self._cache_body
-        proxy = await self._body.text()
-        self._cached = True
-        self._cache_body = to_py(proxy)
-        return self._cache_body
+        self._body = None
+        self._response = response
+
+    async def body(self) -> bytes:
+        if self._body is None:
+            self._body = (await self._response.arrayBuffer()).to_bytes()
+        return self._body
 
 
 class ClientExecutor(FrameworkClientExecutor):
@@ -85,7 +116,7 @@ class ClientExecutor(FrameworkClientExecutor):
 
         body = await request.body()
         if body:
-            options["body"] = body
+            options["body"] = to_array_buffer(body)
 
         url = urlunparse(request.url)
         result = await fetch(url, to_js(options))
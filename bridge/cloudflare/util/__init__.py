@@ -42,3 +42,8 @@ def to_py(obj):
     if not isinstance(obj, JsProxy):
         return obj
     return obj.to_py()
+
+
+def to_array_buffer(data):
+    """Copy a bytes like body into a JS ArrayBuffer, the only copy between Python and JS."""
+    return _to_js(memoryview(data)).buffer
@@ -1,15 +1,55 @@
 from .http import ClientExecutor as BridgeClientExecutor
-from .http.server import CronScheduler, HttpServer
+from .http.server import CronScheduler, HttpServer, Supervisor
 from .sql import Database
-from ...di import Container, ServiceProvider
+from ...di import Container, ServiceProvider, Lifetime
 from ...bridge import CloudContext as FrameworkCloudContext
 from ...kernel import HttpKernel as FrameworkHttpKernel
 from ...http import ClientExecutor
-from asyncio import new_event_loop, gather
+from asyncio import new_event_loop, get_running_loop, ensure_future, wait, Event, FIRST_COMPLETED
+from ...util import logger
 import os
+import signal
+import socket
+import time
+
+
+class TaskTracker:
+    """Keeps track of background tasks so they can be drained on shutdown."""
+
+    def __init__(self):
+        self._tasks = set()
+
+    def spawn(self, coroutine):
+        task = ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def drain(self, timeout: float = None):
+        if not self._tasks:
+            return
+        logger(__name__).info(f"Draining {len(self._tasks)} background tasks")
+        _, pending = await wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger(__name__).warning(f"Cancelled {len(pending)} background tasks after {timeout}s")
 
 
 class CloudContext(FrameworkCloudContext):
+    def __init__(self, tasks: TaskTracker = None):
+        super().__init__()
+        self._tasks = tasks
+
+    async def wait_until(self, coroutine):
+        if self._tasks is None:
+            await coroutine
+            return
+        self._tasks.spawn(coroutine)
+
     async def sql(self, arguments) -> Database:
         if "name" not in arguments:
             arguments["name"] = await self.config("default.database", "APP")
@@ -32,30 +72,124 @@ class App(ServiceProvider):
 
         self.kernel = kernel
         self.container = kernel.container
+        self.tasks = TaskTracker()
         self.container.provide(self)
-        
 
     def services(self):
-        yield ClientExecutor, lambda _: BridgeClientExecutor()
-        yield FrameworkCloudContext, lambda _: CloudContext()
+        yield ClientExecutor, lambda _: BridgeClientExecutor(), Lifetime.SINGLETON
+        yield FrameworkCloudContext, lambda _: CloudContext(self.tasks)
+
+    def run(
+            self,
+            host='0.0.0.0',
+            port=8000,
+            cron_interval=30,
+            init = None,
+            drain_timeout=30,
+            keep_alive_timeout=5,
+            workers=1
+    ):
+        """
+        Run the application with HTTP server and cron scheduler.
+        With more than one worker, the server runs in that many forked processes sharing the port,
+        the cron scheduler only runs in the first one.
+        """
+        if workers <= 1:
+            self.serve(host, port, cron_interval, init, drain_timeout, keep_alive_timeout)
+            return
 
-    def run(self, host='0.0.0.0', port=8000, cron_interval=30, init = None):
-        """Run the application with HTTP server and cron scheduler"""
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Running multiple workers requires os.fork")
+
+        sock = None
+        reuse_port = hasattr(socket, "SO_REUSEPORT")
+        if not reuse_port:
+            # Without SO_REUSEPORT the workers inherit a socket bound before forking
+            sock = socket.create_server((host, port), reuse_port=False)
+            sock.set_inheritable(True)
+
+        def worker(index):
+            self.serve(
+                host,
+                port,
+                cron_interval if index == 0 else None,
+                init,
+                drain_timeout,
+                keep_alive_timeout,
+                reuse_port=reuse_port,
+                sock=sock
+            )
+
+        # Leave the workers time to drain before killing them
+        Supervisor(worker, workers, shutdown_timeout=drain_timeout + 5).run()
+
+    def serve(
+            self,
+            host='0.0.0.0',
+            port=8000,
+            cron_interval=30,
+            init = None,
+            drain_timeout=30,
+            keep_alive_timeout=5,
+            reuse_port=False,
+            sock=None
+    ):
+        """Run the HTTP server and, unless cron_interval is None, the cron scheduler in this process"""
         async def main():
             async def container_builder(_: Container):
-                _.set(CloudContext, lambda _: CloudContext())
+                _.set(FrameworkCloudContext, lambda _: CloudContext(self.tasks))
 
             if init is not None:
                 await init()
 
-            # Create instances
-            cron_scheduler = CronScheduler(self, container_builder, interval=cron_interval)
-            http_server = HttpServer(self, container_builder, host=host, port=port)
-
-            # Run both in parallel
-            await gather(
-                cron_scheduler.run(),
-                http_server.run()
+            http_server = HttpServer(
+                self,
+                container_builder,
+                host=host,
+                port=port,
+                keep_alive_timeout=keep_alive_timeout,
+                reuse_port=reuse_port,
+                sock=sock
             )
+            cron_scheduler = None
+            if cron_interval is not None:
+                cron_scheduler = CronScheduler(self, container_builder, interval=cron_interval)
+
+            # Run both in parallel until a signal asks to stop
+            stopping = Event()
+            loop = get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(sig, stopping.set)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            running = [ensure_future(http_server.run())]
+            if cron_scheduler is not None:
+                running.append(ensure_future(cron_scheduler.run()))
+            stop = ensure_future(stopping.wait())
+            await wait([stop, *running], return_when=FIRST_COMPLETED)
+            stop.cancel()
+            for task in running:
+                if task.done():
+                    # Raise the error of a server or scheduler that stopped on its own
+                    task.result()
+
+            logger(__name__).info("Shutting down")
+            started = time.monotonic()
+            if cron_scheduler is not None:
+                cron_scheduler.stop()
+            await http_server.shutdown(drain_timeout)
+            _, pending = await wait(running, timeout=max(0.0, drain_timeout - (time.monotonic() - started)))
+            for task in pending:
+                task.cancel()
+            await self.tasks.drain(max(0.0, drain_timeout - (time.monotonic() - started)))
+            logger(__name__).info(f"Shut down in {time.monotonic() - started:.2f}s")
 
-        new_event_loop().run_until_complete(main())
\ No newline at end of file
+        loop = new_event_loop()
+        try:
+            loop.run_until_complete(main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.tasks.drain(drain_timeout))
+            loop.close()
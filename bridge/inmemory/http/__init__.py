@@ -8,13 +8,12 @@ class ClientExecutor(FrameworkClientExecutor):
             url.netloc)
 
         headers = request.headers.as_dict()
-        body_str = await request.body()
-        body = body_str.encode("utf-8") if body_str else None
+        body = await request.body()
 
-        conn.request(request.method, url.path + ("?" + url.query if url.query else ""), body, headers)
+        conn.request(request.method, url.path + ("?" + url.query if url.query else ""), body or None, headers)
         response = conn.getresponse()
 
-        response_body = response.read().decode("utf-8")
+        response_body = response.read()
         response_headers = dict(response.getheaders())
 
         conn.close()
@@ -1,7 +1,13 @@
-from ....http import Request
-from asyncio import sleep, start_server
+from ....http import Request, Response, StreamingResponse
+from asyncio import (
+    start_server, wait_for, wait, current_task, Event, CancelledError, IncompleteReadError, LimitOverrunError, TimeoutError
+)
+from http import HTTPStatus
+import os
+import signal
+import time
 
-from ....util import logger
+from ....util import logger, exception_traceback
 
 
 class CronScheduler:
@@ -11,117 +17,416 @@ class CronScheduler:
         self.app = app
         self.container_builder = container_builder
         self.interval = interval
+        self._stopping = Event()
     
     async def run(self):
-        """Run the cron task every interval seconds"""
+        """Run the cron task every interval seconds until stop is called"""
         logger().info(f"Starting cron task scheduler (every {self.interval} seconds)")
-        while True:
+        while not self._stopping.is_set():
             try:
                 logger().info("Running cron task...")
                 await self.app.kernel.cron(self.container_builder)
                 logger().info("Cron task completed")
             except Exception as e:
                 logger().error(f"Error in cron task: {e}")
-            await sleep(self.interval)
+            try:
+                await wait_for(self._stopping.wait(), self.interval)
+            except TimeoutError:
+                pass
+
+    def stop(self):
+        """Let run return, a cron task in progress is finished first"""
+        self._stopping.set()
+
+
+class BadRequest(Exception):
+    pass
+
+
+def reason_phrase(status_code: int) -> str:
+    try:
+        return HTTPStatus(status_code).phrase
+    except ValueError:
+        return ""
+
+
+class RequestBody:
+    """Reads a request body from the connection while it is consumed"""
+
+    def __init__(self, reader, writer, length=0, chunked=False, expect_continue=False, chunk_size=65536):
+        self._reader = reader
+        self._writer = writer
+        self._length = length
+        self._chunked = chunked
+        self._expect_continue = expect_continue
+        self._chunk_size = chunk_size
+        self.started = False
+        self.complete = not chunked and not length
+
+    def __aiter__(self):
+        return self.chunks()
+
+    async def chunks(self):
+        self.started = True
+        if self._expect_continue:
+            self._writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await self._writer.drain()
+        if self._chunked:
+            while True:
+                size_line = await self._reader.readuntil(b'\r\n')
+                try:
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise BadRequest(f"Invalid chunk size '{size_line}'")
+                if size == 0:
+                    # Skip trailers
+                    while await self._reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    break
+                async for chunk in self.read(size):
+                    yield chunk
+                if await self._reader.readexactly(2) != b'\r\n':
+                    raise BadRequest("Missing chunk terminator")
+        else:
+            async for chunk in self.read(self._length):
+                yield chunk
+        self.complete = True
+
+    async def read(self, size):
+        while size:
+            chunk = await self._reader.read(min(size, self._chunk_size))
+            if not chunk:
+                raise IncompleteReadError(b'', size)
+            size -= len(chunk)
+            yield chunk
+
+    async def discard(self, max_size) -> bool:
+        """Skip a body the application did not read, returns False if the connection has to be closed instead"""
+        if self.complete:
+            return True
+        if self.started or self._chunked or self._expect_continue or self._length > max_size:
+            return False
+        try:
+            async for _ in self.chunks():
+                pass
+        except IncompleteReadError:
+            return False
+        return True
 
 
 class HttpServer:
-    """HTTP server that handles incoming requests"""
-    
-    def __init__(self, app, container_builder, host='0.0.0.0', port=8000):
+    """HTTP/1.1 server with persistent connections, requests on a connection are handled in order"""
+
+    def __init__(
+            self,
+            app,
+            container_builder,
+            host='0.0.0.0',
+            port=8000,
+            keep_alive_timeout=5,
+            max_header_size=65536,
+            reuse_port=False,
+            sock=None
+    ):
         self.app = app
         self.container_builder = container_builder
         self.host = host
         self.port = port
-    
-    def parse_http_request(self, data):
-        """Parse HTTP request from raw bytes"""
-        try:
-            lines = data.decode('utf-8').split('\r\n')
-            request_line = lines[0].split(' ')
-            method = request_line[0]
-            path = request_line[1] if len(request_line) > 1 else '/'
-
-            headers = {}
-            body_start = 0
-            for i, line in enumerate(lines[1:], 1):
-                if line == '':
-                    body_start = i + 1
-                    break
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    headers[key.strip()] = value.strip()
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_header_size = max_header_size
+        self.reuse_port = reuse_port
+        self.sock = sock
+        self.max_discard_size = 65536
+        self._server = None
+        self._connections = {}
+        self._closing = False
+        self._stopped = Event()
 
-            body = '\r\n'.join(lines[body_start:]) if body_start < len(lines) else ''
+    def parse_head(self, data):
+        """Parse the request line and headers from raw bytes"""
+        lines = data.decode('latin-1').split('\r\n')
+        request_line = lines[0].split(' ')
+        if len(request_line) != 3 or not request_line[2].startswith('HTTP/'):
+            raise BadRequest(f"Invalid request line '{lines[0]}'")
+        method, path, version = request_line
 
-            return method, path, headers, body
-        except Exception as e:
-            logger().error(f"Error parsing HTTP request: {e}")
-            return 'GET', '/', {}, ''
-    
-    async def handle_connection(self, reader, writer):
-        """Handle individual HTTP connections"""
+        headers = {}
+        for line in lines[1:]:
+            if line == '':
+                break
+            if ':' not in line:
+                raise BadRequest(f"Invalid header line '{line}'")
+            key, value = line.split(':', 1)
+            key = key.strip()
+            # Repeated headers are combined like RFC 9110 allows
+            headers[key] = f"{headers[key]}, {value.strip()}" if key in headers else value.strip()
+
+        return method, path, version, headers
+
+    async def read_request(self, reader, writer):
+        """
+        Read the head of the next request of a connection, returns None if the client closed it or it was idle too long.
+        The body is read while the application consumes it.
+        """
         try:
-            data = await reader.read(8192)
-            if not data:
-                writer.close()
-                await writer.wait_closed()
-                return
+            head = await wait_for(reader.readuntil(b'\r\n\r\n'), self.keep_alive_timeout)
+        except TimeoutError:
+            return None
+        except IncompleteReadError as e:
+            if e.partial.strip():
+                raise BadRequest("Incomplete request head")
+            return None
+        except LimitOverrunError:
+            raise BadRequest("Request head too large")
 
-            method, path, headers, body = self.parse_http_request(data)
+        method, path, version, headers = self.parse_head(head)
+        lower = {k.lower(): v for k, v in headers.items()}
 
-            # Log incoming request
-            logger().info(f"Incoming HTTP request: {method} {path}")
+        chunked = 'chunked' in lower.get('transfer-encoding', '').lower()
+        length = 0
+        if not chunked and 'content-length' in lower:
+            try:
+                length = int(lower['content-length'])
+            except ValueError:
+                raise BadRequest(f"Invalid Content-Length '{lower['content-length']}'")
+            if length < 0:
+                raise BadRequest(f"Invalid Content-Length '{length}'")
+        expect_continue = lower.get('expect', '').lower() == '100-continue'
+        body = RequestBody(reader, writer, length, chunked, expect_continue)
 
-            # Get host header
-            host = headers.get('Host', f'{self.host}:{self.port}')
+        connection = lower.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = 'keep-alive' in connection
+        else:
+            keep_alive = 'close' not in connection
 
-            # Convert to microapi Request
-            url = f"http://{host}{path}"
-            request = Request(
-                url=url,
-                method=method,
-                body=body,
-                headers=headers
-            )
+        return method, path, version, headers, body, keep_alive
 
-            # Handle request through the kernel
-            response = await self.app.kernel.handle(request, self.container_builder)
+    def build_head(self, status_code, headers, keep_alive: bool, length: int = None) -> bytes:
+        """Build the status line and headers, with chunked transfer encoding if length is None"""
+        lines = [f"HTTP/1.1 {status_code} {reason_phrase(status_code)}"]
+        for k, v in headers.items():
+            if k.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+                lines.append(f"{k}: {v}")
+        if length is None:
+            lines.append("Transfer-Encoding: chunked")
+        elif status_code >= 200 and status_code not in (204, 304):
+            lines.append(f"Content-Length: {length}")
+        if not keep_alive:
+            lines.append("Connection: close")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
 
-            # Build HTTP response
-            response_body = await response.body()
-            response_headers = '\r\n'.join([f"{k}: {v}" for k, v in response.headers.as_dict().items()])
+    def build_response(self, method, status_code, headers, body: bytes, keep_alive: bool) -> bytes:
+        head = self.build_head(status_code, headers, keep_alive, len(body))
+        if method == 'HEAD' or status_code < 200 or status_code in (204, 304):
+            return head
+        return head + body
 
-            http_response = (
-                f"HTTP/1.1 {response.status_code} OK\r\n"
-                f"{response_headers}\r\n"
-                f"Content-Length: {len(response_body.encode('utf-8'))}\r\n"
-                f"\r\n"
-                f"{response_body}"
-            )
+    async def handle_request(self, method, path, headers, body, client_ip=None) -> Response:
+        # Log incoming request
+        logger().info(f"Incoming HTTP request: {method} {path}")
 
-            writer.write(http_response.encode('utf-8'))
-            await writer.drain()
+        # Get host header
+        host = next((v for k, v in headers.items() if k.lower() == 'host'), f'{self.host}:{self.port}')
 
-        except Exception as e:
-            logger().error(f"Error handling connection: {e}")
-            error_response = (
-                "HTTP/1.1 500 Internal Server Error\r\n"
-                "Content-Type: text/plain\r\n"
-                "Content-Length: 21\r\n"
-                "\r\n"
-                "Internal Server Error"
-            )
-            writer.write(error_response.encode('utf-8'))
+        # Convert to microapi Request
+        request = Request(
+            url=f"http://{host}{path}",
+            method=method,
+            headers=headers,
+            stream=body,
+            client_ip=client_ip
+        )
+
+        # Handle request through the kernel
+        return await self.app.kernel.handle(request, self.container_builder)
+
+    async def write_response(self, writer, method, version, response: Response, keep_alive: bool) -> bool:
+        """Write a response, streaming responses with chunked transfer encoding. Returns whether to keep the connection"""
+        status_code = response.status_code
+        headers = response.headers.as_dict()
+
+        has_body = method != 'HEAD' and status_code >= 200 and status_code not in (204, 304)
+
+        if isinstance(response, StreamingResponse) and version != 'HTTP/1.0':
+            writer.write(self.build_head(status_code, headers, keep_alive))
+            if not has_body:
+                await writer.drain()
+                return keep_alive
+            try:
+                async for chunk in response.stream():
+                    writer.writelines((b'%x\r\n' % len(chunk), chunk, b'\r\n'))
+                    await writer.drain()
+            except Exception as e:
+                # The status line is sent already, closing without the last chunk marks the body incomplete
+                logger().error(f"Error streaming response: {e}")
+                return False
+            writer.write(b'0\r\n\r\n')
             await writer.drain()
+            return keep_alive
+
+        body = await response.body()
+        # The body is written as is, it is not copied into the head
+        writer.write(self.build_head(status_code, headers, keep_alive, len(body)))
+        if has_body and body:
+            writer.write(body)
+        await writer.drain()
+        return keep_alive
+
+    async def handle_connection(self, reader, writer):
+        """Handle the requests of a connection until the client closes it or it is idle for keep_alive_timeout"""
+        task = current_task()
+        self._connections[task] = False
+        try:
+            while not self._closing:
+                try:
+                    request = await self.read_request(reader, writer)
+                except (BadRequest, LimitOverrunError) as e:
+                    logger().warning(f"Bad request: {e}")
+                    writer.write(self.build_response('GET', 400, {"Content-Type": "text/plain"}, b"Bad Request", False))
+                    await writer.drain()
+                    break
+                except IncompleteReadError:
+                    break
+                if request is None:
+                    break
+
+                method, path, version, headers, body, keep_alive = request
+                self._connections[task] = True
+                try:
+                    peer = writer.get_extra_info("peername")
+                    client_ip = peer[0] if isinstance(peer, tuple) else None
+                    response = await self.handle_request(method, path, headers, body, client_ip)
+                except Exception as e:
+                    logger().error(f"Error handling request: {e}")
+                    response = Response("Internal Server Error", {"Content-Type": "text/plain"}, 500)
+                    keep_alive = False
+
+                # The next request can only be read once the rest of this body is
+                keep_alive = keep_alive and not self._closing and await body.discard(self.max_discard_size)
+                keep_alive = await self.write_response(writer, method, version, response, keep_alive)
+                self._connections[task] = False
+                if not keep_alive:
+                    break
+        except (ConnectionError, OSError) as e:
+            logger().debug(f"Connection error: {e}")
+        except CancelledError:
+            # The stream protocol treats a cancelled connection task as an error
+            if not self._closing:
+                raise
         finally:
+            self._connections.pop(task, None)
             writer.close()
-            await writer.wait_closed()
-    
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
     async def run(self):
-        """Start the HTTP server"""
+        """Start the HTTP server and serve until shutdown is called"""
         logger().info(f"Starting HTTP server on http://{self.host}:{self.port}")
-        server = await start_server(self.handle_connection, self.host, self.port)
+        if self.sock is not None:
+            self._server = await start_server(self.handle_connection, sock=self.sock, limit=self.max_header_size)
+        else:
+            self._server = await start_server(
+                self.handle_connection,
+                self.host,
+                self.port,
+                limit=self.max_header_size,
+                reuse_port=self.reuse_port or None
+            )
+        await self._stopped.wait()
+
+    async def shutdown(self, timeout=None):
+        """
+        Stop accepting connections, close idle ones and wait for in-flight requests to be answered.
+        Connections still busy after timeout seconds are cancelled.
+        """
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+
+        for task, busy in list(self._connections.items()):
+            if not busy:
+                task.cancel()
+        busy = [task for task, _busy in self._connections.items() if _busy]
+        if busy:
+            logger().info(f"Waiting for {len(busy)} in-flight requests")
+            _, pending = await wait(busy, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger().warning(f"Cancelled {len(pending)} requests after {timeout}s")
+        self._stopped.set()
+
+
+class Supervisor:
+    """Forks worker processes and restarts them when they exit unexpectedly"""
+
+    def __init__(self, target, workers, shutdown_timeout=30):
+        self.target = target
+        self.workers = workers
+        self.shutdown_timeout = shutdown_timeout
+        self._children = {}
+        self._deadline = None
+
+    def spawn(self, index):
+        """Fork a worker running target(index)"""
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            code = 0
+            try:
+                self.target(index)
+            except BaseException as e:
+                logger().error(f"Worker {index} failed: {exception_traceback(e)}")
+                code = 1
+            finally:
+                os._exit(code)
+        logger().info(f"Started worker {index} with pid {pid}")
+        self._children[pid] = (index, time.monotonic())
+
+    def stop(self, signum=signal.SIGTERM, frame=None):
+        """Forward the signal to the workers and wait for them to exit until shutdown_timeout"""
+        if self._deadline is None:
+            logger().info(f"Stopping {len(self._children)} workers")
+            self._deadline = time.monotonic() + self.shutdown_timeout
+        for pid in self._children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self._children:
+            if self._deadline is not None and time.monotonic() > self._deadline:
+                logger().warning(f"Killing {len(self._children)} workers after {self.shutdown_timeout}s")
+                for pid in self._children:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                self._deadline = float("inf")
+
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.1)
+                continue
 
-        async with server:
-            await server.serve_forever()
+            index, started = self._children.pop(pid)
+            if self._deadline is not None:
+                continue
+            logger().warning(f"Worker {index} exited with code {os.waitstatus_to_exitcode(status)}, restarting")
+            # Do not restart a worker crashing on startup in a tight loop
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.spawn(index)
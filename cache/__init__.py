@@ -0,0 +1,264 @@
+import asyncio
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from ..http import Request, Response
+from ..kv import Store
+from ..util import json_dumps, json_loads, logger
+
+
+_abandoned = object()
+
+def cache(ttl: int = None, tags: list[str] = None, vary: list[str] = None):
+    """
+    Cache the responses of a route. Without a ttl the max-age of the Cache-Control header is used,
+    the headers in vary are part of the cache key. Requests with an Authorization header are only
+    cached if it is listed in vary.
+    """
+    def decorator(func: Callable):
+        func._cache = {
+            "ttl": ttl,
+            "tags": list(tags or []),
+            "vary": [header.lower() for header in vary or []],
+        }
+        return func
+    return decorator
+
+
+def coalesce(timeout: float = 10, vary: list[str] = None):
+    """
+    Let concurrent identical GET requests to a route wait for the response of the first one instead of
+    running the controller. Requests are identical if path, query, Authorization, Cookie and the headers
+    in vary are. Waiting requests run the controller themselves after timeout seconds.
+    """
+    def decorator(func: Callable):
+        func._coalesce = {
+            "timeout": timeout,
+            "vary": [header.lower() for header in vary or []],
+        }
+        return func
+    return decorator
+
+
+def _declaration(request: Request, name: str) -> Optional[dict]:
+    controller = request.attributes.get("_controller")
+    method_name = request.attributes.get("_controller_method")
+    if controller is None or method_name is None:
+        return None
+    return getattr(getattr(controller, method_name, None), name, None)
+
+
+def cache_policy(request: Request) -> Optional[dict]:
+    """Return the cache declaration of the controller the request was routed to."""
+    return _declaration(request, "_cache")
+
+
+def coalesce_policy(request: Request) -> Optional[dict]:
+    """Return the coalesce declaration of the controller the request was routed to."""
+    return _declaration(request, "_coalesce")
+
+
+def request_key(request: Request, headers: list[str]) -> str:
+    """Hash method, path, query and the given headers of a request, HEAD is treated like GET."""
+    parts = [request.method if request.method != "HEAD" else "GET", request.path or "/"]
+    if request.query:
+        parts.append(repr(sorted(request.query.items())))
+    for header in headers:
+        parts.append(f"{header}={request.headers.get(header, '')}")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+def etag(body: bytes) -> str:
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str, value: str) -> bool:
+    """Weak comparison as required for If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    value = value.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == value for candidate in if_none_match.split(","))
+
+
+class LocalCache:
+    """In-process LRU of cache entries, shared by all requests."""
+    def __init__(self, max_entries: int = 1024):
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, entry = item
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict, expires_at: float):
+        self._entries[key] = (expires_at, entry)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def invalidate(self, tag: str):
+        for key in [key for key, (_, entry) in self._entries.items() if tag in entry["tags"]]:
+            del self._entries[key]
+
+    def cache_info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self._max_entries,
+        }
+
+
+class ResponseCache:
+    """
+    Caches responses in the LocalCache and, if given, a Store shared by all instances. Entries read
+    from the store are kept locally for at most local_ttl seconds, so an invalidation on another
+    instance is visible after that time at the latest.
+    """
+    def __init__(self, local: LocalCache, store: Store = None, local_ttl: int = 5):
+        self._local = local
+        self._store = store
+        self._local_ttl = local_ttl
+
+    def _local_expiry(self, entry: dict) -> float:
+        if self._store is None:
+            return entry["expires_at"]
+        return min(entry["expires_at"], time.time() + self._local_ttl)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._local.get(key)
+        if entry is not None or self._store is None:
+            return entry
+
+        raw = await self._store.get(f"response:{key}")
+        if raw is None:
+            return None
+        data = json_loads(raw)
+        if data["expires_at"] <= time.time():
+            await self._store.delete(f"response:{key}")
+            return None
+        entry = {**data, "body": base64.b64decode(data["body"])}
+        self._local.put(key, entry, self._local_expiry(entry))
+        return entry
+
+    async def put(self, key: str, response: Response, ttl: int, tags: list[str] = None):
+        """Store a response, its ETag header is expected to be set."""
+        entry = {
+            "status_code": response.status_code,
+            "headers": response.headers.as_dict(),
+            "body": await response.body(),
+            "expires_at": time.time() + ttl,
+            "tags": list(tags or []),
+        }
+        self._local.put(key, entry, self._local_expiry(entry))
+        if self._store is None:
+            return
+
+        data = {**entry, "body": base64.b64encode(entry["body"]).decode("ascii")}
+        await self._store.put(f"response:{key}", json_dumps(data).decode("utf-8"))
+        # The key lists are read and written without locking, a concurrent put may drop a key
+        for tag in entry["tags"]:
+            keys = json_loads(await self._store.get(f"tag:{tag}") or "[]")
+            if key not in keys:
+                keys.append(key)
+                await self._store.put(f"tag:{tag}", json_dumps(keys).decode("utf-8"))
+
+    async def invalidate(self, *tags: str):
+        """Remove all responses cached with one of the tags."""
+        for tag in tags:
+            self._local.invalidate(tag)
+            if self._store is None:
+                continue
+            keys = json_loads(await self._store.get(f"tag:{tag}") or "[]")
+            for key in keys:
+                self._local.delete(key)
+                await self._store.delete(f"response:{key}")
+            await self._store.delete(f"tag:{tag}")
+            logger(__name__).debug("Invalidated %d cached responses tagged %s", len(keys), tag)
+
+    @staticmethod
+    def response(entry: dict) -> Response:
+        return Response(entry["body"], entry["headers"], entry["status_code"])
+
+
+class Singleflight:
+    """Tracks the leading request per key in this process, the others wait for its response."""
+    def __init__(self):
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key: str) -> tuple[asyncio.Future, bool]:
+        """Return the future of the leading request and whether the caller became the leader."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        return future, True
+
+    def resolve(self, key: str, future: asyncio.Future, response: Optional[Response]):
+        """
+        Hand the response of the leader to the waiting requests, None lets them run the controller
+        themselves. The response must not be streaming.
+        """
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.done():
+            future.set_result(response)
+
+    def abandon(self, key: str, future: asyncio.Future):
+        """The leader failed or was cancelled, the first waiting request takes over."""
+        self.resolve(key, future, _abandoned)
+
+    async def wait(self, key: str, future: asyncio.Future, timeout: float) -> tuple[Optional[Response], Optional[asyncio.Future]]:
+        """
+        Wait up to timeout seconds for the response of the leader. If the leader was abandoned the first
+        waiting request becomes the leader, it gets no response but the future to resolve instead.
+        Raises asyncio.TimeoutError after releasing the key.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(future), deadline - loop.time())
+            except asyncio.TimeoutError:
+                # Release the key, the leader may be stuck and would block it forever
+                self.resolve(key, future, None)
+                raise
+            if response is not _abandoned:
+                return response, None
+            future, leader = self.join(key)
+            if leader:
+                return None, future
+
+    @staticmethod
+    async def copy(response: Response) -> Response:
+        return Response(await response.body(), response.headers.as_dict(), response.status_code)
+
+    def info(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
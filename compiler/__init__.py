@@ -0,0 +1,225 @@
+import hashlib
+import importlib
+import inspect
+from typing import Any
+
+from ..di import Container, tags
+from ..event import EventDispatcher
+from ..router import Router, routes_of
+from ..util import logger, call_async
+
+
+def _is_literal(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def _importable(obj) -> bool:
+    """Whether obj can be referenced from a generated module by importing it."""
+    module = getattr(obj, "__module__", None)
+    qualname = getattr(obj, "__qualname__", None)
+    if module is None or qualname is None or module == "__main__" or "<" in qualname:
+        return False
+    try:
+        resolved = importlib.import_module(module)
+        for part in qualname.split("."):
+            resolved = getattr(resolved, part)
+    except (ImportError, AttributeError):
+        return False
+    return resolved is obj
+
+
+def describe(obj) -> str:
+    """Describe a service id or provider without reflecting on it."""
+    if _is_literal(obj):
+        return repr(obj)
+    if hasattr(obj, "__qualname__"):
+        return f"{getattr(obj, '__module__', None)}.{obj.__qualname__}"
+    return f"{type(obj).__module__}.{type(obj).__qualname__}"
+
+
+def services(container: Container) -> tuple:
+    """Describe the registered services and their lifetimes, used to detect stale artifacts cheaply."""
+    items = []
+    for name in container.service_ids():
+        if name is Container:
+            continue
+        provider = container.provider(name)
+        items.append((
+            describe(name),
+            "autowire" if provider is None else describe(provider),
+            container.lifetime(name).value
+        ))
+    return tuple(items)
+
+
+class ContainerCompiler:
+    """Compiles the services of a container to a plain Python module."""
+
+    def __init__(self, container: Container):
+        self._container = container
+        self._references = {}
+        self._imports = []
+
+    def reference(self, obj) -> str:
+        """Return the expression referencing obj in the generated module."""
+        if _is_literal(obj):
+            return repr(obj)
+        key = id(obj)
+        if key not in self._references:
+            if not _importable(obj):
+                raise ValueError(f"Cannot compile a reference to '{obj}', it is not importable")
+            alias = f"_{len(self._references)}"
+            self._references[key] = alias
+            self._imports.append(f"from {obj.__module__} import {obj.__qualname__.split('.')[0]} as {alias}")
+            if "." in obj.__qualname__:
+                self._imports.append(f"{alias} = {alias}.{obj.__qualname__.split('.', 1)[1]}")
+        return self._references[key]
+
+    def tags(self) -> dict:
+        index = {}
+        for name in self._container.service_ids():
+            for _tag in tags(name):
+                index[_tag] = self._container.tagged_ids(_tag)
+        return index
+
+    def routes(self) -> list:
+        return [
+            (http_method, _route, cls, method_name)
+            for cls in self._container.tagged_ids("controller")
+            for _route, http_method, method_name in routes_of(cls)
+        ]
+
+    def listeners(self) -> dict:
+        return EventDispatcher.compile(tuple(self._container.tagged_ids("event_subscriber")))
+
+    def fingerprint(self) -> str:
+        """Hash everything the generated module is derived from, including signatures."""
+        parts = [repr(services(self._container))]
+        for name in self._container.service_ids():
+            if inspect.isclass(name) or inspect.isfunction(name):
+                try:
+                    parts.append(f"{describe(name)}{inspect.signature(name)}")
+                except (TypeError, ValueError):
+                    pass
+        parts.append(repr(sorted((k, [describe(_) for _ in v]) for k, v in self.tags().items())))
+        parts.append(repr([(m, r, describe(c), n) for m, r, c, n in self.routes()]))
+        parts.append(repr(sorted(
+            (describe(k), [(p, describe(c), n, k) for p, c, n, k in v]) for k, v in self.listeners().items()
+        )))
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+    def factory(self, name) -> str | None:
+        """Generate a factory function for an autowired service, or None if it must stay reflective."""
+        if not inspect.isclass(name) or getattr(name, "_parallel", False) or not _importable(name):
+            return None
+        arguments = []
+        for param_name, param in inspect.signature(name).parameters.items():
+            if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+                return None
+            if param.annotation is inspect.Parameter.empty:
+                if param.default is inspect.Parameter.empty:
+                    return None
+                continue
+            if not _is_literal(param.annotation) and not _importable(param.annotation):
+                return None
+            arguments.append(f"{param_name}=await _.get({self.reference(param.annotation)})")
+        return f"{self.reference(name)}({', '.join(arguments)})"
+
+    def compile(self) -> str:
+        fingerprint = self.fingerprint()
+
+        factories = []
+        functions = []
+        for name in self._container.service_ids():
+            if self._container.provider(name) is not None:
+                continue
+            expression = self.factory(name)
+            if expression is None:
+                continue
+            function_name = f"_factory_{len(functions)}"
+            functions.append(f"async def {function_name}(_):\n    return {expression}\n")
+            factories.append(
+                f"    ({self.reference(name)}, {function_name}, {self._container.lifetime(name).value!r}),"
+            )
+
+        tag_lines = [
+            f"    {_tag!r}: ({''.join(self.reference(_) + ', ' for _ in ids)}),"
+            for _tag, ids in self.tags().items()
+        ]
+        route_lines = [
+            f"    ({m!r}, {r!r}, {self.reference(c)}, {n!r}),"
+            for m, r, c, n in self.routes()
+        ]
+        listener_lines = [
+            f"    {self.reference(_event)}: ({''.join(f'({p!r}, {self.reference(c)}, {n!r}, {k!r}), ' for p, c, n, k in items)}),"
+            for _event, items in self.listeners().items()
+        ]
+        service_lines = [f"    {item!r}," for item in services(self._container)]
+
+        return "\n".join([
+            "# Generated by microapi.compiler, do not edit.",
+            *self._imports,
+            "",
+            f"FINGERPRINT = {fingerprint!r}",
+            "",
+            "SERVICES = (", *service_lines, ")",
+            "",
+            *functions,
+            "FACTORIES = (", *factories, ")",
+            "",
+            "TAGS = {", *tag_lines, "}",
+            "",
+            "ROUTES = (", *route_lines, ")",
+            "",
+            "LISTENERS = {", *listener_lines, "}",
+            "",
+        ])
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.compile())
+
+
+def is_stale(container: Container, compiled: Any) -> bool:
+    """Compare a compiled module against a fresh reflection of the container."""
+    return getattr(compiled, "FINGERPRINT", None) != ContainerCompiler(container).fingerprint()
+
+
+def _with_table(container: Container, name, table):
+    """Wrap the registered factory of a service so the created instance uses a compiled table."""
+    provider = container.provider(name)
+
+    async def factory(_: Container):
+        if provider is None:
+            instance = await _.call(name)
+        else:
+            instance = await call_async(provider, _)
+        instance.set_table(table)
+        return instance
+
+    container.set(name, factory, container.lifetime(name))
+
+
+def load(container: Container, compiled: Any) -> bool:
+    """
+    Replace runtime reflection with the tables of a compiled module.
+    Only the registered services are compared, reflecting on their classes would cost what the module
+    saves. Constructors, tags, routes and listeners are verified when building with is_stale().
+    Returns False and leaves the container untouched if the services do not match.
+    """
+    if getattr(compiled, "SERVICES", None) != services(container):
+        logger(__name__).warning(f"Compiled container {compiled.__name__} is stale, using reflection")
+        return False
+
+    for name, factory, _lifetime in compiled.FACTORIES:
+        container.set(name, factory, _lifetime)
+    container.set_tag_index(compiled.TAGS)
+
+    service_ids = container.service_ids()
+    if Router in service_ids:
+        _with_table(container, Router, compiled.ROUTES)
+    if EventDispatcher in service_ids:
+        _with_table(container, EventDispatcher, compiled.LISTENERS)
+
+    logger(__name__).debug(f"Loaded compiled container {compiled.__name__}")
+    return True
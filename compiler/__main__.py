@@ -0,0 +1,34 @@
+import argparse
+import importlib
+import importlib.util
+import sys
+
+from . import ContainerCompiler, is_stale
+from ..kernel import HttpKernel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the container of a microapi application to a Python module")
+    parser.add_argument("service_providers", help="callable returning the service providers, e.g. app:service_providers")
+    parser.add_argument("output", help="path of the generated module")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if the generated module is stale")
+    args = parser.parse_args()
+
+    module_name, attr = args.service_providers.split(":", 1)
+    service_providers = getattr(importlib.import_module(module_name), attr)
+    kernel = HttpKernel(service_providers=service_providers())
+
+    if args.check:
+        spec = importlib.util.spec_from_file_location("compiled_container", args.output)
+        compiled = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(compiled)
+        if is_stale(kernel.container, compiled):
+            print(f"{args.output} is stale", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    ContainerCompiler(kernel.container).write(args.output)
+
+
+if __name__ == "__main__":
+    main()
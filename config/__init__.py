@@ -1,11 +1,16 @@
 from .. import CloudContextQueueBindingFactory
-from ..di import ServiceProvider
-from ..event import EventDispatcher
+from ..bridge import CloudContext
+from ..cache import LocalCache, ResponseCache, Singleflight
+from ..di import ServiceProvider, Lifetime
+from ..event import EventDispatcher, ListenerTables
 from ..event_subscriber import RoutingEventSubscriber, SecurityEventSubscriber, SerializeEventSubscriber, \
-    CorsEventSubscriber, QueueProcessEventSubscriber
+    CorsEventSubscriber, QueueProcessEventSubscriber, RequestBodyEventSubscriber, AccessLogEventSubscriber, \
+    CompressionEventSubscriber, ResponseCacheEventSubscriber, CoalesceEventSubscriber, RateLimitEventSubscriber
 from ..queue import BatchMessageHandlerManager, QueueProcessor
-from ..router import Router
+from ..router import Router, RouteTrees
 from ..http import Client, ClientFactory
+from ..kernel import ConcurrencyLimiter, BackgroundTasks
+from ..ratelimit import RateLimiter, IP, policy
 from ..di import Container
 from ..security import Security, TokenStore, Firewall, DefaultVoter, JwtTokenResolver, UserResolver, \
     JwtUserResolver
@@ -15,19 +20,96 @@ from ..workflow import WorkflowManager, WorkflowEventSubscriber, WorkflowManager
 
 
 class FrameworkServiceProvider(ServiceProvider):
-    def __init__(self, cors_origin: str = None, cors_methods: list[str] = None, cors_headers: list[str] = None):
+    def __init__(
+            self,
+            cors_origin: str = None,
+            cors_methods: list[str] = None,
+            cors_headers: list[str] = None,
+            route_cache_size: int = 0,
+            max_body_size: int = None,
+            access_log_sample_rate: float = 1.0,
+            access_log_bodies: bool = False,
+            compression: bool = False,
+            compression_min_size: int = 1024,
+            compression_types: list[str] = None,
+            response_cache_size: int = 0,
+            response_cache_store: dict = None,
+            response_cache_local_ttl: int = 5,
+            max_in_flight: int = None,
+            max_queue: int = 100,
+            queue_timeout: float = 1,
+            retry_after: int = 1,
+            rate_limit: float = None,
+            rate_limit_burst: int = None,
+            rate_limit_by: str = IP,
+            rate_limit_store: dict = None,
+            rate_limit_sync_interval: float = 1,
+            rate_limiting: bool = False
+    ):
         self._cors_origin = cors_origin
         self._cors_methods = cors_methods
         self._cors_headers = cors_headers
+        self._route_cache_size = route_cache_size
+        self._max_body_size = max_body_size
+        self._access_log_sample_rate = access_log_sample_rate
+        self._access_log_bodies = access_log_bodies
+        self._compression = compression
+        self._compression_min_size = compression_min_size
+        self._compression_types = compression_types
+        self._response_cache_size = response_cache_size
+        self._response_cache_store = response_cache_store
+        self._response_cache_local_ttl = response_cache_local_ttl
+        self._max_in_flight = max_in_flight
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._retry_after = retry_after
+        self._rate_limit = rate_limit
+        self._rate_limit_burst = rate_limit_burst
+        self._rate_limit_by = rate_limit_by
+        self._rate_limit_store = rate_limit_store
+        self._rate_limit_sync_interval = rate_limit_sync_interval
+        self._rate_limiting = rate_limiting or rate_limit is not None
 
     def services(self):
         # HTTP
-        yield Router, lambda _: Router(_.tagged_generator('controller'))
-        yield EventDispatcher, lambda _: EventDispatcher(_.tagged_generator('event_subscriber'))
+        # Scoped so controllers registered in a request scope are routed, the compiled trees are shared
+        yield RouteTrees, lambda _: RouteTrees(self._route_cache_size), Lifetime.SINGLETON
+        yield Router, FrameworkServiceProvider.router_factory
+        yield ListenerTables, lambda _: ListenerTables(), Lifetime.SINGLETON
+        yield EventDispatcher, FrameworkServiceProvider.event_dispatcher_factory
         if self._cors_origin is not None:
             yield CorsEventSubscriber, lambda _: CorsEventSubscriber(self._cors_origin, self._cors_methods, self._cors_headers)
         yield RoutingEventSubscriber
         yield SerializeEventSubscriber
+        yield Singleflight, None, Lifetime.SINGLETON
+        yield CoalesceEventSubscriber
+        if self._max_body_size is not None:
+            yield RequestBodyEventSubscriber, lambda _: RequestBodyEventSubscriber(self._max_body_size)
+        if self._access_log_sample_rate > 0:
+            yield AccessLogEventSubscriber, lambda _: AccessLogEventSubscriber(
+                self._access_log_sample_rate,
+                log_bodies=self._access_log_bodies
+            )
+        if self._compression:
+            yield CompressionEventSubscriber, lambda _: CompressionEventSubscriber(
+                _,
+                self._compression_min_size,
+                self._compression_types
+            )
+        if self._response_cache_size > 0:
+            yield LocalCache, lambda _: LocalCache(self._response_cache_size), Lifetime.SINGLETON
+            yield ResponseCache, self.response_cache_factory
+            yield ResponseCacheEventSubscriber
+        if self._max_in_flight is not None:
+            yield ConcurrencyLimiter, lambda _: ConcurrencyLimiter(
+                self._max_in_flight,
+                self._max_queue,
+                self._queue_timeout,
+                self._retry_after
+            ), Lifetime.SINGLETON
+        if self._rate_limiting:
+            yield RateLimiter, lambda _: RateLimiter(sync_interval=self._rate_limit_sync_interval), Lifetime.SINGLETON
+            yield RateLimitEventSubscriber, self.rate_limit_factory
 
         # Queue
         yield BatchMessageHandlerManager, lambda _: BatchMessageHandlerManager(_.tagged_generator('queue_message_handler'))
@@ -49,10 +131,44 @@ class FrameworkServiceProvider(ServiceProvider):
         yield WorkflowQueue, CloudContextQueueBindingFactory.create(WorkflowQueue)
 
         # Util
+        # Scoped, its message loaders may depend on the CloudContext of the request
         yield TranslatorFactory
-        yield ClientFactory
+        yield ClientFactory, None, Lifetime.SINGLETON
         yield Client, FrameworkServiceProvider.client_factory
 
+    @staticmethod
+    async def router_factory(_: Container) -> Router:
+        return Router(_.tagged_generator('controller'), shared=await _.get(RouteTrees))
+
+    @staticmethod
+    async def event_dispatcher_factory(_: Container) -> EventDispatcher:
+        return EventDispatcher(_.tagged_generator('event_subscriber'), shared=await _.get(ListenerTables))
+
+    async def response_cache_factory(self, _: Container) -> ResponseCache:
+        store = None
+        if self._response_cache_store is not None:
+            store = await (await _.get(CloudContext)).kv(self._response_cache_store)
+        return ResponseCache(await _.get(LocalCache), store, self._response_cache_local_ttl)
+
+    async def rate_limit_factory(self, _: Container) -> RateLimitEventSubscriber:
+        store = None
+        if self._rate_limit_store is not None:
+            store = await (await _.get(CloudContext)).kv(self._rate_limit_store)
+        token_store = None
+        if await _.has(TokenStore):
+            token_store = await _.get(TokenStore)
+        default = None
+        if self._rate_limit is not None:
+            default = policy(self._rate_limit, self._rate_limit_burst, self._rate_limit_by)
+        return RateLimitEventSubscriber(
+            await _.get(RateLimiter),
+            await _.get(BackgroundTasks),
+            await _.get(Router),
+            token_store,
+            store,
+            default
+        )
+
     @staticmethod
     async def client_factory(_: Container) -> Client:
         client_factory = await _.get(ClientFactory)
@@ -77,8 +193,8 @@ class SecurityServiceProvider(ServiceProvider):
         if self.jwt_secret is not None:
             if user_resolver is None:
                 user_resolver = JwtUserResolver
-            yield JwtUserResolver, lambda _: JwtUserResolver(self.jwt_secret)
-            yield JwtTokenResolver, SecurityServiceProvider.jwt_token_resolver_factory(self.jwt_secret)
+            yield JwtUserResolver, lambda _: JwtUserResolver(self.jwt_secret), Lifetime.SINGLETON
+            yield JwtTokenResolver, SecurityServiceProvider.jwt_token_resolver_factory(self.jwt_secret), Lifetime.SINGLETON
 
         # Security
         yield TokenStore
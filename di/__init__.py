@@ -1,92 +1,274 @@
+import asyncio
+import contextvars
 import inspect
-import copy
+from enum import Enum
 from typing import Callable, Tuple, List, Any
 
 from ..util import call_async, logger
 
 
-def tag(_tag: str):
+_removed = object()
+_cancelled = object()
+_resolving = contextvars.ContextVar("resolving", default=frozenset())
+# The singleton under construction, it must not capture services of a scope
+_singleton = contextvars.ContextVar("singleton", default=None)
+
+
+def tag(_tag: str, priority: int = 0):
     def decorator(func: Callable):
-        if not hasattr(func, "_tags"):
-            func._tags = []
+        # Copy inherited tags so tagging a subclass does not tag its parent
+        if "_tags" not in vars(func):
+            func._tags = list(getattr(func, "_tags", []))
+            func._tag_priorities = dict(getattr(func, "_tag_priorities", {}))
         logger(__name__).debug(f"Tag '{type(func)}' with {_tag}")
-        func._tags.append(_tag)
+        if _tag not in func._tags:
+            func._tags.append(_tag)
+        func._tag_priorities[_tag] = priority
+        return func
+    return decorator
+
+
+def tags(name) -> dict:
+    """Return the tags of a service id mapped to their priority."""
+    if not (inspect.isclass(name) or inspect.isfunction(name)) or not hasattr(name, "_tags"):
+        return {}
+    priorities = getattr(name, "_tag_priorities", {})
+    return {_tag: priorities.get(_tag, 0) for _tag in name._tags}
+
+
+class Lifetime(str, Enum):
+    SINGLETON = "singleton"
+    SCOPED = "scoped"
+    TRANSIENT = "transient"
+
+
+def lifetime(_lifetime: Lifetime):
+    def decorator(cls):
+        logger(__name__).debug(f"Lifetime of '{cls}' is {_lifetime}")
+        cls._lifetime = Lifetime(_lifetime)
+        return cls
+    return decorator
+
+
+def parallel(enabled: bool = True):
+    """Resolve the injected services of a class or function concurrently."""
+    def decorator(func: Callable):
+        func._parallel = enabled
         return func
     return decorator
 
 
+class InjectionPlan:
+    """The parameters of a callable and the services they are resolved from."""
+
+    def __init__(self, parameters, is_async: bool = False, is_parallel: bool = False):
+        self.parameters = parameters
+        self.is_async = is_async
+        self.is_parallel = is_parallel
+
+    @staticmethod
+    def create(func) -> 'InjectionPlan':
+        parameters = []
+        for param_name, param in inspect.signature(func).parameters.items():
+            parameters.append((param_name, param.annotation))
+        return InjectionPlan(
+            tuple(parameters),
+            asyncio.iscoroutinefunction(func),
+            getattr(func, "_parallel", False)
+        )
+
+
 class Container:
-    def __init__(self, services=None):
-        self._services = services or {}
+    def __init__(self, services=None, parent: 'Container' = None):
+        self._parent = parent
+        self._services = {}
+        self._lifetimes = {}
         self._instances = {}
+        self._pending = {}
+        self._tag_index = {}
+        self._local_tags = set()
+        for name, provider in (services or {}).items():
+            self.set(name, provider)
         self.set(Container, self)
 
     def provide(self, service_provider: 'ServiceProvider'):
         logger(__name__).debug(f"Register provider '{type(service_provider)}'")
         for svs in service_provider.services():
             provider = None
+            _lifetime = None
             if isinstance(svs, tuple):
-                name, provider = svs
+                if len(svs) == 3:
+                    name, provider, _lifetime = svs
+                else:
+                    name, provider = svs
             else:
                 name = svs
-            self.set(name, provider)
+            self.set(name, provider, _lifetime)
 
-    def set(self, name, provider=None):
+    def set(self, name, provider=None, _lifetime: Lifetime = None):
         """Register a service provider by name."""
         logger(__name__).debug(f"Register '{name}' factory")
+        if _lifetime is None:
+            _lifetime = getattr(name, "_lifetime", Lifetime.SCOPED)
         self._services[name] = provider
+        self._lifetimes[name] = Lifetime(_lifetime)
+        self._instances.pop(name, None)
+        self._index_tags(name)
+
+    def _index_tags(self, name):
+        """Add a service id to the tag index, ordered by tag priority and then registration."""
+        for _tag in tags(name):
+            self._local_tags.add(_tag)
+            ids = self._tag_index.get(_tag, ())
+            if name not in ids:
+                ids = sorted(ids + (name,), key=lambda _: tags(_)[_tag])
+                self._tag_index[_tag] = tuple(ids)
+
+    def _unindex_tags(self, name):
+        for _tag in tags(name):
+            self._local_tags.add(_tag)
+            ids = self._tag_index.get(_tag, ())
+            if name in ids:
+                self._tag_index[_tag] = tuple(_ for _ in ids if _ != name)
+
+    def set_tag_index(self, index: dict):
+        """Replace the tag index, e.g. with the one of a compiled module, ids must be ordered by priority."""
+        self._local_tags.update(index)
+        self._tag_index = dict(index)
 
     def build(self):
-        """Create a new container instance with fresh instances."""
-        return Container(copy.deepcopy(self._services))
+        """Create a child scope sharing the definitions and singletons of this container."""
+        return Container(parent=self)
+
+    def _definition(self, name):
+        """Return the container defining a service, its provider and its lifetime."""
+        container = self
+        while container is not None:
+            if name in container._services:
+                provider = container._services[name]
+                if provider is _removed:
+                    return None
+                return container, provider, container._lifetimes[name]
+            container = container._parent
+        return None
 
     async def has(self, name):
-        return name in self._services
+        return self._definition(name) is not None
+
+    def provider(self, name):
+        """Return the registered provider of a service, None if it is autowired."""
+        definition = self._definition(name)
+        if definition is None:
+            raise ValueError(f"Service '{name}' not found")
+        return definition[1]
+
+    def lifetime(self, name) -> Lifetime:
+        definition = self._definition(name)
+        if definition is None:
+            raise ValueError(f"Service '{name}' not found")
+        return definition[2]
 
     async def get(self, name):
         """Resolve a service by name, returning the same instance every time."""
         if name in self._instances:
             return self._instances[name]
 
-        if not await self.has(name):
+        definition = self._definition(name)
+        if definition is None:
             raise ValueError(f"Service '{name}' not found")
 
-        provider = self._services.get(name)
+        owner, provider, _lifetime = definition
+        if _lifetime == Lifetime.SINGLETON and owner is not self:
+            return await owner.get(name)
+
+        if not callable(provider) and provider is not None:
+            self._instances[name] = provider
+            return provider
+
+        singleton = _singleton.get()
+        if singleton is not None and _lifetime == Lifetime.SCOPED:
+            raise RuntimeError(f"Singleton '{singleton}' cannot depend on the scoped service '{name}'")
+
+        resolving = _resolving.get()
+        if (self, name) in resolving:
+            raise RuntimeError(f"Circular dependency while constructing '{name}'")
+
+        # Concurrent callers share the construction already in flight. If it was cancelled they
+        # construct the service themselves, the first of them becoming the one the others wait for.
+        while name in self._pending:
+            instance = await asyncio.shield(self._pending[name])
+            if instance is not _cancelled:
+                return instance
+        if name in self._instances:
+            return self._instances[name]
+
+        token = _resolving.set(resolving | {(self, name)})
+        singleton_token = _singleton.set(name) if _lifetime == Lifetime.SINGLETON else None
+        try:
+            if _lifetime == Lifetime.TRANSIENT:
+                return await self._construct(name, provider)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[name] = future
+            try:
+                instance = await self._construct(name, provider)
+            except asyncio.CancelledError:
+                # Only this caller was cancelled, let the waiting callers retry
+                future.set_result(_cancelled)
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                # Mark the exception as retrieved in case no other caller is waiting
+                future.exception()
+                raise
+            finally:
+                self._pending.pop(name, None)
+            self._instances[name] = instance
+            future.set_result(instance)
+            return instance
+        finally:
+            _resolving.reset(token)
+            if singleton_token is not None:
+                _singleton.reset(singleton_token)
+
+    async def _construct(self, name, provider):
         if provider is None:
             logger(__name__).debug(f"Construct '{name}' using autowire")
             provider = self.autowire(name)
         else:
             logger(__name__).debug(f"Construct '{name}' using factory")
-
-        if callable(provider):
-            instance = await call_async(provider, self)
-        else:
-            instance = provider
-
-        self._instances[name] = instance
-        return instance
+        return await call_async(provider, self)
 
     def service_ids(self):
-        return self._services.keys()
+        if self._parent is None:
+            return [name for name, provider in self._services.items() if provider is not _removed]
+        ids = dict.fromkeys(self._parent.service_ids())
+        for name, provider in self._services.items():
+            if provider is _removed:
+                ids.pop(name, None)
+            else:
+                ids[name] = None
+        return ids.keys()
 
     def tagged_ids(self, _tag: str):
-        for cls in self.service_ids():
-            if inspect.isclass(cls) or inspect.isfunction(cls):
-                if hasattr(cls, "_tags") and _tag in cls._tags:
-                    yield cls
+        """Return the ids of the services tagged with _tag, ordered by tag priority."""
+        if self._parent is None:
+            return self._tag_index.get(_tag, ())
+
+        ids = self._parent.tagged_ids(_tag)
+        if _tag not in self._local_tags:
+            return ids
+
+        # Merge services this scope added, overrode or removed for the tag
+        local = [name for name in ids if name not in self._services]
+        local += self._tag_index.get(_tag, ())
+        return tuple(sorted(local, key=lambda _: tags(_)[_tag]))
 
     async def tagged(self, _tag: str):
         for name in self.tagged_ids(_tag):
             yield await self.get(name)
 
-    def tagged_generator(self, _tag: str):
-        def generate():
-            for cls in self.tagged_ids(_tag):
-                async def do_get():
-                    return await self.get(cls)
-                yield cls, do_get
-
-        return generate
+    def tagged_generator(self, _tag: str) -> 'TaggedServices':
+        return TaggedServices(self, _tag)
 
     def autowire(self, name):
         async def do_call(_):
@@ -95,28 +277,83 @@ class Container:
 
     def remove(self, name):
         """Unregister a service by name."""
-        self._services.pop(name, None)
+        if self._parent is not None and self._parent._definition(name) is not None:
+            self._services[name] = _removed
+        else:
+            self._services.pop(name, None)
+            self._lifetimes.pop(name, None)
         self._instances.pop(name, None)
+        self._unindex_tags(name)
+
+    def plan(self, func) -> InjectionPlan:
+        """Return the injection plan of a function or class, stored on it on first use."""
+        # Bound methods are recreated on every attribute access, so store their plan on the function.
+        # It is released together with the function, like closures created per request.
+        attr = "_method_injection_plan" if inspect.ismethod(func) else "_injection_plan"
+        target = getattr(func, "__func__", func)
+        try:
+            # vars() and not getattr(), a subclass must not use the plan of its parent
+            return vars(target)[attr]
+        except KeyError:
+            plan = InjectionPlan.create(func)
+            try:
+                setattr(target, attr, plan)
+            except (AttributeError, TypeError):
+                pass
+            return plan
+        except TypeError:
+            return InjectionPlan.create(func)
 
     async def call(self, func, args_dict=None):
         """Resolve services required by a function based on argument types."""
-        # Get the function's signature and inspect argument types
         if args_dict is None:
             args_dict = {}
-        signature = inspect.signature(func)
+        plan = self.plan(func)
         resolved_args = {}
 
-        for param_name, param in signature.parameters.items():
-            param_type = param.annotation
+        services = []
+        for param_name, param_type in plan.parameters:
             if param_name in args_dict:
                 resolved_args[param_name] = args_dict[param_name]
             elif param_type is not inspect.Parameter.empty:
                 if not await self.has(param_type):
                     raise RuntimeError(f"Argument '{param_name}' has no registered service '{param_type}'")
-                service = await self.get(param_type)
-                resolved_args[param_name] = service
+                services.append((param_name, param_type))
+
+        if plan.is_parallel and len(services) > 1:
+            instances = await asyncio.gather(*(self.get(param_type) for _, param_type in services))
+            for (param_name, _), instance in zip(services, instances):
+                resolved_args[param_name] = instance
+        else:
+            for param_name, param_type in services:
+                resolved_args[param_name] = await self.get(param_type)
+
+        if plan.is_async:
+            return await func(**resolved_args)
+        return func(**resolved_args)
+
+
+class TaggedServices:
+    """Yields (service id, getter) pairs of a tag when called, resolving each service only when its getter is awaited."""
+
+    def __init__(self, container: Container, _tag: str):
+        self._container = container
+        self._tag = _tag
+
+    def ids(self) -> tuple:
+        return self._container.tagged_ids(self._tag)
+
+    async def get(self, name):
+        return await self._container.get(name)
+
+    def _getter(self, name):
+        async def do_get():
+            return await self.get(name)
+        return do_get
 
-        return await call_async(func, **resolved_args)
+    def __call__(self):
+        for name in self.ids():
+            yield name, self._getter(name)
 
 
 class ServiceProvider:
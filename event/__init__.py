@@ -1,14 +1,22 @@
+import asyncio
+from collections import OrderedDict
 from threading import Event
+from types import MappingProxyType
 from typing import Type, Callable
 
+from ..di import TaggedServices
 from ..util import call_async, logger
 
 
-def listen(_event: Type[Event], priority: int = 0):
+def listen(_event: Type[Event], priority: int = 0, concurrent: bool = False):
+    """
+    Subscribe a method to an event. Adjacent concurrent listeners of the same priority
+    are awaited together, see EventDispatcher.dispatch.
+    """
     def decorator(func: Callable):
-        if not hasattr(func, "_"):
+        if not hasattr(func, "_subscribed_events"):
             func._subscribed_events = []
-        func._subscribed_events.append((priority, _event))
+        func._subscribed_events.append((priority, _event, concurrent))
         return func
     return decorator
 
@@ -24,39 +32,148 @@ class Event:
         return self._propagation_stopped
 
 
+def listeners_of(cls: Type):
+    """Yield the (priority, event type, method name, concurrent) declarations of a subscriber class."""
+    for attr_name in dir(cls):
+        attr = getattr(cls, attr_name)
+        if callable(attr) and hasattr(attr, "_subscribed_events"):
+            for priority, _event, concurrent in getattr(attr, "_subscribed_events"):
+                yield priority, _event, attr_name, concurrent
+
+
+class ListenerTables:
+    """
+    The listener tables of the max_sets most recently used sets of subscribers, shared by request scoped
+    dispatchers. A scope registering its own subscribers gets its own table.
+    """
+    def __init__(self, max_sets: int = 8):
+        self._sets = OrderedDict()
+        self._max_sets = max_sets
+
+    def get(self, subscriber_ids: tuple, table: dict = None) -> tuple:
+        """
+        Return the table compiled for a set of subscribers, or the given one, and the subscribers to filter
+        its entries by. A compiled table only contains the subscribers, so they are None.
+        """
+        key = (table is not None, subscriber_ids)
+        entry = self._sets.get(key)
+        if entry is not None:
+            self._sets.move_to_end(key)
+            return entry
+        if table is None:
+            entry = (EventDispatcher.compile(subscriber_ids), None)
+        else:
+            entry = (table, frozenset(subscriber_ids))
+        self._sets[key] = entry
+        if len(self._sets) > self._max_sets:
+            self._sets.popitem(last=False)
+        return entry
+
+
 class EventDispatcher:
-    def __init__(self, subscribers: Callable):
+    def __init__(self, subscribers: Callable, table: dict = None, concurrency: int = 8, shared: ListenerTables = None):
         self._subscribers = subscribers
+        self._table = table
+        self._concurrency = concurrency
+        self._shared = shared if shared is not None else ListenerTables()
+        self._entry = None
+        self._subscriber_ids = None
+
+    def set_table(self, table: dict):
+        self._table = table
+        self._entry = None
 
     async def dispatch(self, event: Event) -> Event:
-        """Dispatches an event to all registered async listeners."""
+        """
+        Dispatches an event to all registered async listeners.
+
+        A group of concurrent listeners always runs to completion: propagation is only checked
+        after the whole group, and if any of them raised, the first exception in listener
+        order is raised once all of them are done.
+        """
         event_type = type(event)
-        logger(__name__).info(f"Dispatching {event_type}")
-        async for listener in self.listeners(event_type):
-            await call_async(listener, event)
+        logger(__name__).info("Dispatching %s", event_type)
+        async for group in self.listener_groups(event_type):
+            if len(group) == 1:
+                await call_async(group[0], event)
+            else:
+                await self._gather(group, event)
             if event.is_propagation_stopped():
                 break
         return event
 
+    async def _gather(self, listeners: list, event: Event):
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def run(listener):
+            async with semaphore:
+                await call_async(listener, event)
+
+        results = await asyncio.gather(*(run(listener) for listener in listeners), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _entries(self, event_type: Type[Event]):
+        if isinstance(self._subscribers, TaggedServices):
+            # Only the subscribers listening to this event are resolved
+            subscriber_ids = self._subscribers.ids()
+            get = self._subscribers.get
+        else:
+            getters = dict(self._subscribers())
+            subscriber_ids = tuple(getters)
+
+            async def get(name):
+                return await getters[name]()
+
+        if self._entry is None or (
+                subscriber_ids is not self._subscriber_ids and subscriber_ids != self._subscriber_ids
+        ):
+            self._entry = self._shared.get(subscriber_ids, self._table)
+            self._subscriber_ids = subscriber_ids
+        table, members = self._entry
+
+        for priority, service_type, attr_name, concurrent in table.get(event_type, ()):
+            if members is None or service_type in members:
+                logger(__name__).debug("Found listener %s.%s", service_type, attr_name)
+                service = await get(service_type)
+                yield priority, getattr(service, attr_name), concurrent
+
+    async def listener_groups(self, event_type: Type[Event]):
+        """Yields the listeners in order, adjacent concurrent listeners of equal priority grouped together."""
+        group = []
+        group_priority = None
+        async for priority, listener, concurrent in self._entries(event_type):
+            if group and (not concurrent or priority != group_priority):
+                yield group
+                group = []
+            group.append(listener)
+            group_priority = priority
+            if not concurrent:
+                yield group
+                group = []
+        if group:
+            yield group
+
     async def listeners_priority(self, event_type: Type[Event]):
         """Returns the list of listeners for a given event type."""
-        for service_type, service_get in self._subscribers():
-            for attr_name in dir(service_type):
-                attr = getattr(service_type, attr_name)
-                if callable(attr) and hasattr(attr, "_subscribed_events"):
-                    _subscribed_events = getattr(attr, "_subscribed_events")
-                    for priority, _event in _subscribed_events:
-                        if _event == event_type:
-                            logger(__name__).debug(f"Found listener {service_type}.{attr_name}")
-                            service = await service_get()
-                            yield priority, getattr(service, attr_name)
+        async for priority, listener, _ in self._entries(event_type):
+            yield priority, listener
 
     async def listeners(self, event_type: Type[Event]):
-        items = []
-        async for priority, listener in self.listeners_priority(event_type):
-            items.append((priority, listener))
-
-        items.sort(key=lambda x: x[0])
+        async for _, listener in self.listeners_priority(event_type):
+            yield listener
 
-        for item in items:
-            yield item[1]
+    @staticmethod
+    def compile(subscriber_ids: tuple) -> MappingProxyType:
+        """
+        Return the event type -> sorted (priority, service id, method name, concurrent) table of the subscribers.
+        Dispatchers share the tables through ListenerTables.
+        """
+        listeners = {}
+        for service_type in subscriber_ids:
+            for priority, _event, attr_name, concurrent in listeners_of(service_type):
+                listeners.setdefault(_event, []).append((priority, service_type, attr_name, concurrent))
+        return MappingProxyType({
+            _event: tuple(sorted(items, key=lambda x: x[0])) for _event, items in listeners.items()
+        })
@@ -1,14 +1,27 @@
-import copy
+import asyncio
+import gzip
 import inspect
+import logging
+import math
+import random
+import time
+import zlib
+from typing import Optional
 
+from ..bridge import CloudContext
+from ..cache import ResponseCache, Singleflight, cache_policy, coalesce_policy, etag, etag_matches, request_key
 from ..cron import CronEvent
 from ..di import tag, Container
 from ..event import listen
-from ..http import JsonResponse, Request, Response
-from ..kernel import RequestEvent, ControllerEvent, ExceptionEvent, HttpException, ViewEvent, ResponseEvent
+from ..http import JsonResponse, Request, Response, RequestBodyTooLarge, StreamingResponse, Headers
+from ..kernel import RequestEvent, ControllerEvent, ExceptionEvent, HttpException, ViewEvent, ResponseEvent, \
+    TerminateEvent, BackgroundTasks
 from ..queue import QueueProcessor, QueueBatchEvent
+from ..kv import Store
+from ..ratelimit import RateLimiter, USER, ROUTE
 from ..router import Router
-from ..security import Firewall
+from ..security import Firewall, TokenStore
+from ..util import logger
 
 
 @tag('event_subscriber')
@@ -25,13 +38,20 @@ class RoutingEventSubscriber:
                 cls, method_name, params = result
                 if event.request.query is not None:
                     for key, value in event.request.query.items():
-                        event.request.attributes[key] = copy.deepcopy(value)
+                        # Underscore attributes are internal, like _controller, and not settable by clients
+                        if not key.startswith("_"):
+                            event.request.attributes[key] = value
 
-                for key, value in params.items():
-                    event.request.attributes[key] = copy.deepcopy(value)
+                event.request.attributes.update(params)
 
                 event.request.attributes["_controller"] = cls
                 event.request.attributes["_controller_method"] = method_name
+            else:
+                allowed_methods = self._router.allowed_methods(event.request)
+                if allowed_methods:
+                    raise HttpException('Method not allowed', status_code=405, headers={
+                        "Allow": ", ".join(allowed_methods)
+                    })
 
     @listen(ControllerEvent)
     async def controller(self, event: ControllerEvent):
@@ -49,6 +69,19 @@ class RoutingEventSubscriber:
     async def exception(self, event: ExceptionEvent):
         if isinstance(event.exception, HttpException):
             event.response = event.exception.to_response()
+        elif isinstance(event.exception, RequestBodyTooLarge):
+            event.response = HttpException(str(event.exception), 413).to_response()
+
+
+@tag('event_subscriber')
+class RequestBodyEventSubscriber:
+    def __init__(self, max_body_size: int):
+        self._max_body_size = max_body_size
+
+    @listen(RequestEvent, -2048)
+    async def limit(self, event: RequestEvent):
+        if event.request.max_body_size is None:
+            event.request.max_body_size = self._max_body_size
 
 
 @tag('event_subscriber')
@@ -129,3 +162,391 @@ class QueueProcessEventSubscriber:
     @listen(QueueBatchEvent)
     async def queue(self, event: QueueBatchEvent):
         await self._processor.handle(event)
+
+
+@tag('event_subscriber')
+class AccessLogEventSubscriber:
+    """
+    Logs one line per request with method, path, status, duration and response size.
+    Nothing is formatted if the level is disabled or the request is not sampled.
+    """
+    def __init__(self, sample_rate: float = 1.0, level: int = logging.INFO, log_bodies: bool = False):
+        self._sample_rate = sample_rate
+        self._level = level
+        self._log_bodies = log_bodies
+        self._started = None
+
+    @listen(RequestEvent, -4096)
+    async def start(self, event: RequestEvent):
+        self._started = time.perf_counter()
+
+    @listen(TerminateEvent)
+    async def log(self, event: TerminateEvent):
+        _logger = logger(__name__)
+        if self._started is None or not _logger.isEnabledFor(self._level):
+            return
+        if self._sample_rate < 1 and random.random() >= self._sample_rate:
+            return
+
+        request = event.request
+        response = event.response
+        duration = (time.perf_counter() - self._started) * 1000
+        size = "-"
+        if not isinstance(response, StreamingResponse):
+            size = len(await response.body())
+
+        message = f"{request.method} {request.path} {response.status_code} {duration:.1f}ms {size}"
+        if self._log_bodies:
+            # Only log a request body the application read, reading it here could block on the client
+            request_body = await request.body() if request.body_read else "-"
+            response_body = "-" if isinstance(response, StreamingResponse) else await response.body()
+            message = f"{message} request={request_body!r} response={response_body!r}"
+
+        _logger.log(self._level, message, extra={
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": duration,
+            "size": size,
+        })
+
+
+@tag('event_subscriber')
+class CompressionEventSubscriber:
+    """
+    Compresses responses with gzip or deflate as negotiated by Accept-Encoding. Streaming responses are compressed
+    chunk by chunk. Nothing is done on Cloudflare, which compresses responses itself.
+    """
+    types = [
+        "text/",
+        "application/json",
+        "application/x-ndjson",
+        "application/javascript",
+        "application/xml",
+        "image/svg+xml",
+    ]
+
+    def __init__(self, container: Container, min_size: int = 1024, types: list[str] = None, level: int = 6):
+        self._container = container
+        self._min_size = min_size
+        self._types = types or CompressionEventSubscriber.types
+        self._level = level
+
+    @staticmethod
+    def negotiate(accept_encoding: str) -> str | None:
+        """Return the preferred of gzip and deflate accepted by the client, None if neither is."""
+        accepted = {}
+        for item in accept_encoding.split(","):
+            name, _, params = item.strip().partition(";")
+            quality = 1.0
+            for param in params.split(";"):
+                key, _, value = param.strip().partition("=")
+                if key == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if name:
+                accepted[name.strip().lower()] = quality
+
+        best = None
+        for encoding in ("gzip", "deflate"):
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if quality > 0 and (best is None or quality > best[1]):
+                best = (encoding, quality)
+        return best[0] if best else None
+
+    def compressible(self, response: Response) -> bool:
+        content_type = (response.content_type or "").split(";")[0].strip().lower()
+        return (
+            any(content_type.startswith(_type) for _type in self._types)
+            and "content-encoding" not in response.headers
+            and "no-transform" not in response.headers.get("cache-control", "").lower()
+            and 200 <= response.status_code and response.status_code not in (204, 304)
+        )
+
+    def compressor(self, encoding: str):
+        # wbits 31 writes a gzip header and trailer, 15 the zlib format HTTP calls deflate
+        return zlib.compressobj(self._level, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+
+    async def compress_stream(self, stream, encoding: str):
+        compressor = self.compressor(encoding)
+        async for chunk in stream:
+            # Flush every chunk so the client receives it without waiting for the next one
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @listen(ResponseEvent, 2048)
+    async def compress(self, event: ResponseEvent):
+        response = event.response
+        if not self.compressible(response):
+            return
+        if await self._container.has(CloudContext):
+            if (await self._container.get(CloudContext)).provider_name == "cloudflare":
+                return
+
+        vary = response.headers.get("vary")
+        if vary is None:
+            response.headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+            response.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+        encoding = self.negotiate(event.request.headers.get("accept-encoding", ""))
+        if encoding is None or event.request.method == "HEAD":
+            return
+
+        headers = Headers.create_from(response.headers)
+        if "content-length" in headers:
+            del headers["content-length"]
+        headers["Content-Encoding"] = encoding
+        if "etag" in headers and not headers["etag"].startswith("W/"):
+            # A strong ETag identifies the exact bytes, which compression changes
+            headers["ETag"] = f"W/{headers['etag']}"
+
+        if isinstance(response, StreamingResponse):
+            event.response = StreamingResponse(
+                self.compress_stream(response.stream(), encoding),
+                headers,
+                response.status_code
+            )
+            return
+
+        body = await response.body()
+        if len(body) < self._min_size:
+            return
+        if encoding == "gzip":
+            compressed = gzip.compress(body, self._level, mtime=0)
+        else:
+            compressed = zlib.compress(body, self._level)
+        event.response = Response(compressed, headers, response.status_code)
+
+
+@tag('event_subscriber')
+class ResponseCacheEventSubscriber:
+    """
+    Answers GET and HEAD requests to routes declared with @cache from the ResponseCache before
+    the controller runs, and 304 if the ETag matches If-None-Match.
+    """
+    def __init__(self, cache: ResponseCache):
+        self._cache = cache
+        self._key = None
+        self._policy = None
+
+    @staticmethod
+    def ttl(response: Response, policy: dict) -> int:
+        cache_control = {}
+        for directive in response.headers.get("cache-control", "").lower().split(","):
+            name, _, value = directive.strip().partition("=")
+            cache_control[name] = value
+        if "no-store" in cache_control or "private" in cache_control or "no-cache" in cache_control:
+            return 0
+        if policy["ttl"] is not None:
+            return policy["ttl"]
+        for name in ("s-maxage", "max-age"):
+            if cache_control.get(name, "").isdigit():
+                return int(cache_control[name])
+        return 0
+
+    @staticmethod
+    def not_modified(response: Response) -> Response:
+        """A 304 with the headers the 200 would have, except those describing its body."""
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() not in ("content-type", "content-length", "content-encoding", "transfer-encoding")
+        }
+        return Response(b"", headers, 304)
+
+    @listen(RequestEvent, 256)
+    async def lookup(self, event: RequestEvent):
+        request = event.request
+        if request.method not in ("GET", "HEAD"):
+            return
+        policy = cache_policy(request)
+        if policy is None:
+            return
+        if "authorization" in request.headers and "authorization" not in policy["vary"]:
+            return
+
+        self._policy = policy
+        self._key = request_key(request, policy["vary"])
+        entry = await self._cache.get(self._key)
+        if entry is None:
+            return
+
+        # Responses returned here still pass ResponseEvent, store() must not write them back
+        self._key = None
+        event.response = ResponseCache.response(entry)
+        event.stop_propagation()
+
+    @listen(ResponseEvent, 1536)
+    async def store(self, event: ResponseEvent):
+        response = event.response
+        if self._key is None or response.status_code != 200 or isinstance(response, StreamingResponse):
+            return
+        if "set-cookie" in response.headers:
+            return
+        ttl = self.ttl(response, self._policy)
+        if ttl <= 0:
+            return
+
+        if "etag" not in response.headers:
+            response.headers["ETag"] = etag(await response.body())
+        await self._cache.put(self._key, response, ttl, self._policy["tags"])
+
+    @listen(ResponseEvent, 4096)
+    async def conditional(self, event: ResponseEvent):
+        """
+        Answer a matching If-None-Match with 304. Runs after compression, so the 304 carries the
+        Vary header and the weakened ETag of the response it revalidates.
+        """
+        response = event.response
+        if self._policy is None or response.status_code != 200 or "etag" not in response.headers:
+            return
+        if etag_matches(event.request.headers.get("if-none-match", ""), response.headers["etag"]):
+            event.response = self.not_modified(response)
+
+
+@tag('event_subscriber')
+class CoalesceEventSubscriber:
+    """
+    Lets GET requests to routes declared with @coalesce wait for an identical request already in flight
+    and answers them with a copy of its response.
+    """
+    def __init__(self, singleflight: Singleflight):
+        self._singleflight = singleflight
+        self._key = None
+        self._future = None
+        self._task = None
+
+    @listen(RequestEvent, 512)
+    async def join(self, event: RequestEvent):
+        request = event.request
+        if request.method not in ("GET", "HEAD"):
+            return
+        policy = coalesce_policy(request)
+        if policy is None:
+            return
+
+        # Requests of different users must never share a response
+        key = request_key(request, ["authorization", "cookie", *policy["vary"]])
+        future, leader = self._singleflight.join(key)
+        if not leader:
+            try:
+                response, future = await self._singleflight.wait(key, future, policy["timeout"])
+            except asyncio.TimeoutError:
+                logger(__name__).warning("Coalesced request %s timed out, running it", request.path)
+                return
+            if future is None:
+                if response is not None:
+                    event.response = await Singleflight.copy(response)
+                    event.stop_propagation()
+                return
+
+        self._key = key
+        self._future = future
+        # A cancelled request dispatches no further events, hand over once its task is done
+        self._task = asyncio.current_task()
+        self._task.add_done_callback(self._abandon)
+
+    def _abandon(self, _=None):
+        if self._key is not None:
+            self._singleflight.abandon(self._key, self._future)
+            self._key = None
+
+    def _resolve(self, response):
+        self._task.remove_done_callback(self._abandon)
+        self._singleflight.resolve(self._key, self._future, response)
+        self._key = None
+
+    @listen(ResponseEvent, 1792)
+    async def share(self, event: ResponseEvent):
+        if self._key is None:
+            return
+        response = None
+        if not isinstance(event.response, StreamingResponse):
+            response = await Singleflight.copy(event.response)
+        self._resolve(response)
+
+    @listen(ExceptionEvent, 1792)
+    async def failed(self, event: ExceptionEvent):
+        if self._key is not None:
+            self._task.remove_done_callback(self._abandon)
+            self._abandon()
+
+
+@tag('event_subscriber')
+class RateLimitEventSubscriber:
+    """
+    Answers requests over the limit of their route, declared with @rate_limit, or the default limit
+    with 429. Decisions are taken by the local buckets of the RateLimiter, which are synchronized with
+    the store in the background.
+    """
+    def __init__(
+            self,
+            limiter: RateLimiter,
+            tasks: BackgroundTasks,
+            router: Router,
+            token_store: TokenStore = None,
+            store: Store = None,
+            default: dict = None
+    ):
+        self._limiter = limiter
+        self._tasks = tasks
+        self._router = router
+        self._token_store = token_store
+        self._store = store
+        self._default = default
+        self._policy = None
+        self._scope = None
+
+    def policy(self, request: Request) -> tuple[Optional[dict], Optional[str]]:
+        """Return the limit of the route matching the request, or the default limit, and its scope."""
+        # Routing runs after authentication, so the route is matched here
+        match = self._router.match(request)
+        if match is not None:
+            controller, method_name, _ = match
+            policy = getattr(getattr(controller, method_name, None), "_rate_limit", None)
+            if policy is not None:
+                return policy, f"{controller.__module__}.{controller.__qualname__}.{method_name}"
+        if self._default is not None:
+            return self._default, "default"
+        return None, None
+
+    async def key(self, request: Request, by: str, scope: str) -> str:
+        if by == ROUTE:
+            return scope
+        if by == USER and self._token_store is not None:
+            token = await self._token_store.get(request)
+            if token is not None and token.user_identifier() is not None:
+                return f"{scope}:user:{token.user_identifier()}"
+        return f"{scope}:ip:{request.client_ip or 'unknown'}"
+
+    @listen(RequestEvent, -768)
+    async def limit_clients(self, event: RequestEvent):
+        """Limits per IP or route run before authentication, unauthenticated floods are throttled too."""
+        self._policy, self._scope = self.policy(event.request)
+        if self._policy is not None and self._policy["by"] != USER:
+            await self.limit(event.request, self._policy, self._scope)
+
+    @listen(RequestEvent, 128)
+    async def limit_users(self, event: RequestEvent):
+        """Limits per user need the token of the request, they run after authentication."""
+        if self._policy is not None and self._policy["by"] == USER:
+            await self.limit(event.request, self._policy, self._scope)
+
+    async def limit(self, request: Request, policy: dict, scope: str):
+        key = await self.key(request, policy["by"], scope)
+        rate, burst = policy["rate"], policy["burst"]
+        if self._store is not None:
+            first = self._limiter.claim_sync(key, burst)
+            if first:
+                # Without any state of the other instances yet, ask the store before deciding
+                await self._limiter.sync(key, rate, burst, self._store)
+            elif first is not None:
+                self._tasks.add(self._limiter.sync, key, rate, burst, self._store)
+
+        retry_after = self._limiter.consume(key, rate, burst)
+        if retry_after > 0:
+            raise HttpException("Too many requests", 429, headers={"Retry-After": str(math.ceil(retry_after))})
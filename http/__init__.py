@@ -1,8 +1,8 @@
-import json
+from tempfile import SpooledTemporaryFile
 from urllib.parse import urlencode, urljoin, parse_qs, urlparse
 import json as _json
-from typing import Any, Optional, Callable, Awaitable
-from ..util import logger, CaseInsensitiveDict
+from typing import Any, Optional, Callable, Awaitable, AsyncIterable, AsyncIterator
+from ..util import logger, CaseInsensitiveDict, json_dumps, json_loads
 
 class Headers(CaseInsensitiveDict):
     @staticmethod
@@ -18,22 +18,120 @@ class Headers(CaseInsensitiveDict):
             obj[k] = v
         return obj
 
+def _as_bytes(body) -> bytes:
+    """Encode a str body and copy other bytes like bodies, like memoryview, which json.loads and ASGI reject."""
+    if isinstance(body, bytes):
+        return body
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode("utf-8")
+    return bytes(body)
+
+
+def _join(chunks: list) -> bytes:
+    if len(chunks) == 1:
+        return _as_bytes(chunks[0])
+    return b"".join(chunks)
+
+
+def _decode(body, content_type: Optional[str]) -> str:
+    charset = "utf-8"
+    for param in (content_type or "").split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset" and value:
+            charset = value.strip('"')
+    return str(body, charset)
+
+
+def _size(body):
+    if isinstance(body, (str, bytes, bytearray, memoryview)):
+        return len(body)
+    return type(body)
+
+
+class RequestBodyTooLarge(Exception):
+    def __init__(self, max_body_size: int):
+        super().__init__(f"Request body exceeds {max_body_size} bytes")
+        self.max_body_size = max_body_size
+
+
 class Request:
-    def __init__(self, url: str = '', method: str = 'GET', body: str = "", headers: dict|Headers = None, attributes: dict = None):
+    def __init__(
+            self,
+            url: str = '',
+            method: str = 'GET',
+            body: str|bytes = b"",
+            headers: dict|Headers = None,
+            attributes: dict = None,
+            stream: AsyncIterable[bytes] = None,
+            client_ip: str = None
+    ):
         self.attributes = attributes or {}
+        # Address of the client as reported by the bridge
+        self.client_ip = client_ip
         self.headers = Headers.create_from(headers)
         self.method = method
         self.url = urlparse(url)
-        self._body = body
+        self._body = body if stream is None else None
+        self._stream = stream
         self._json = None
+        self.max_body_size = None
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """
+        Yield the body in chunks as they are received. A streamed body can only be consumed once,
+        unless it was read with body() before. Raises RequestBodyTooLarge once more than max_body_size bytes are read.
+        """
+        if self._stream is None:
+            if self._body is None:
+                raise RuntimeError("Request body stream was consumed already")
+            if self._body:
+                yield _as_bytes(self._body)
+            return
+
+        source = self._stream
+        self._stream = None
+        if self.max_body_size is not None:
+            length = self.headers.get("content-length")
+            if length is not None and length.isdigit() and int(length) > self.max_body_size:
+                raise RequestBodyTooLarge(self.max_body_size)
+
+        size = 0
+        async for chunk in source:
+            size += len(chunk)
+            if self.max_body_size is not None and size > self.max_body_size:
+                raise RequestBodyTooLarge(self.max_body_size)
+            yield chunk
 
-    async def body(self) -> str:
+    @property
+    def body_read(self) -> bool:
+        """Whether the body is available without reading it from the client."""
+        return self._body is not None
+
+    async def body(self) -> bytes:
+        if self._body is None:
+            self._body = _join([chunk async for chunk in self.stream()])
+        elif not isinstance(self._body, bytes):
+            self._body = _as_bytes(self._body)
         return self._body
 
+    async def text(self) -> str:
+        """Decode the body using the charset of the content type, UTF-8 by default."""
+        return _decode(await self.body(), self.content_type)
+
+    async def spool(self, max_memory_size: int = 1024 * 1024) -> SpooledTemporaryFile:
+        """Write the body to a file kept in memory up to max_memory_size bytes and on disk above, positioned at its start."""
+        file = SpooledTemporaryFile(max_size=max_memory_size)
+        async for chunk in self.stream():
+            file.write(chunk)
+        file.seek(0)
+        return file
+
     async def json(self) -> Any:
         if self._json is not None:
             return self._json
-        self._json = _json.loads(await self.body())
+        self._json = json_loads(await self.body())
         return self._json
 
     @property
@@ -56,12 +154,7 @@ class Request:
         return {k: v[0] for k, v in query.items()}
 
     def __str__(self):
-        body = type(self._body)
-        if isinstance(self._body, str):
-            body = len(self._body)
-        else:
-            body = type(body)
-
+        body = "stream" if self._body is None else _size(self._body)
         return f"Request : {self.method} {self.url} headers={_json.dumps(self.headers.as_dict())} body={body}"
 
 
@@ -82,34 +175,82 @@ class Response:
             raise Exception(f"HTTP Error {self.status_code}")
         return self
 
-    async def body(self):
+    async def body(self) -> bytes:
+        if not isinstance(self._body, bytes):
+            self._body = _as_bytes(self._body)
         return self._body
 
+    async def text(self) -> str:
+        """Decode the body using the charset of the content type, UTF-8 by default."""
+        return _decode(await self.body(), self.content_type)
+
     async def json(self):
-        return _json.loads(self._body)
+        return json_loads(await self.body())
 
     def __str__(self):
-        body = type(self._body)
-        if isinstance(self._body, str):
-            body = len(self._body)
-        else:
-            body = type(body)
-
-        return f"Response : status_code={self.status_code} headers={_json.dumps(self.headers.as_dict())} body={body}"
+        return f"Response : status_code={self.status_code} headers={_json.dumps(self.headers.as_dict())} body={_size(self._body)}"
 
 
 class JsonResponse(Response):
+    """Response serializing its payload once, when the body is first read after the payload was set."""
     def __init__(self, body="", headers: dict|Headers=None, status_code=200):
         headers = Headers.create_from(headers)
         headers["Content-Type"] = "application/json"
+        self._encoded = None
         super().__init__(body, headers, status_code)
 
-    async def body(self):
-        return json.dumps(await self.json())
+    @property
+    def _body(self):
+        return self._payload
+
+    @_body.setter
+    def _body(self, value):
+        self._payload = value
+        self._encoded = None
+
+    async def body(self) -> bytes:
+        if self._encoded is None:
+            self._encoded = json_dumps(self._payload)
+        return self._encoded
 
     async def json(self):
+        return self._payload
+
+
+class StreamingResponse(Response):
+    """
+    Response sending the chunks of an async iterable of bytes or str as they are produced,
+    without a Content-Length. The iterable is consumed once.
+    """
+    def __init__(self, content: AsyncIterable[bytes|str], headers: dict|Headers=None, status_code=200, media_type: str = None):
+        headers = Headers.create_from(headers)
+        if media_type is not None:
+            headers["Content-Type"] = media_type
+        super().__init__("", headers, status_code)
+        self._content = content
+        self._consumed = False
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        if self._consumed:
+            # body() already read the whole stream
+            if self._body:
+                yield self._body
+            return
+        self._consumed = True
+        async for chunk in self._content:
+            chunk = _as_bytes(chunk)
+            if chunk:
+                yield chunk
+
+    async def body(self) -> bytes:
+        """Read the whole stream, only for callers which cannot handle streaming."""
+        if not self._consumed:
+            self._body = _join([chunk async for chunk in self.stream()])
         return self._body
 
+    def __str__(self):
+        return f"StreamingResponse : status_code={self.status_code} headers={_json.dumps(self.headers.as_dict())}"
+
 
 class RedirectResponse(Response):
     def __init__(self, url, status_code=302, headers: dict|Headers=None):
@@ -119,7 +260,7 @@ class RedirectResponse(Response):
 
 
 class ClientRequest(Request):
-    def __init__(self, url: str, method: str = "GET", headers: dict|Headers = None, body: str = ""):
+    def __init__(self, url: str, method: str = "GET", headers: dict|Headers = None, body: str|bytes = b""):
         super().__init__(url=url, method=method, headers=headers, body=body)
 
 class ClientResponse(Response):
@@ -150,7 +291,7 @@ class Client:
 
         body = ""
         if json is not None:
-            body = _json.dumps(json)
+            body = json_dumps(json)
             if "content-type" not in updated_headers:
                 updated_headers["content-type"] = "application/json;charset=UTF-8"
         elif data is not None:
@@ -172,15 +313,16 @@ class Client:
         if self.executor is None:
             raise RuntimeError(f"No HTTP Request executor")
 
-        request_body = await client_request.body()
-        if not self._debug:
-            request_body = len(request_body)
-        logger(__name__).info(f"Client HTTP Request {client_request} - {request_body}")
+        _logger = logger(__name__)
+        if self._debug:
+            _logger.info(f"Client HTTP Request {client_request} - {await client_request.body()}")
+        else:
+            _logger.debug("Client HTTP Request %s", client_request)
         client_response = await self.executor.do_request(client_request)
-        response_body = await client_response.body()
-        if not self._debug:
-            response_body = len(response_body)
-        logger(__name__).info(f"Client HTTP Response {client_response} - {response_body}")
+        if self._debug:
+            _logger.info(f"Client HTTP Response {client_response} - {await client_response.body()}")
+        else:
+            _logger.debug("Client HTTP Response %s", client_response)
 
         return client_response
 
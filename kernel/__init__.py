@@ -1,12 +1,16 @@
-import json
-from typing import Any
+import asyncio
+import heapq
+import itertools
+from contextlib import asynccontextmanager
+from typing import Any, Callable
 
+from ..bridge import CloudContext
 from ..cron import CronEvent
 from ..di import Container
 from ..event import Event, EventDispatcher
 from ..http import Response, Request
 from ..queue import QueueBatchEvent, MessageBatch
-from ..util import logger, exception_traceback
+from ..util import logger, exception_traceback, call_async, json_dumps
 from ..workflow import WorkflowEvent
 
 class HttpException(Exception):
@@ -20,7 +24,7 @@ class HttpException(Exception):
         trace = None
         if self.exception:
             trace = exception_traceback(self.exception)
-        return Response(json.dumps({"error": self.message,"trace":trace}), status_code=self.status_code, headers=self.headers)
+        return Response(json_dumps({"error": self.message,"trace":trace}), status_code=self.status_code, headers=self.headers)
 
 
 class BootedEvent(Event):
@@ -66,6 +70,133 @@ class ExceptionEvent(Event):
         self.response = None
 
 
+class TerminateEvent(Event):
+    """Dispatched after the response has been handed to the bridge."""
+    def __init__(self, request: Request, response: Response):
+        super().__init__()
+        self.request = request
+        self.response = response
+
+
+class BackgroundTasks:
+    """Request scoped tasks which run after the response has been handed to the bridge."""
+    def __init__(self):
+        self._tasks = []
+
+    def add(self, func: Callable, *args, **kwargs):
+        self._tasks.append((func, args, kwargs))
+
+    async def run(self):
+        for func, args, kwargs in self._tasks:
+            try:
+                await call_async(func, *args, **kwargs)
+            except Exception as e:
+                logger(__name__).error(f"Background task {func} failed: {exception_traceback(e)}")
+        self._tasks = []
+
+
+
+CRITICAL = "critical"
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+
+def priority(_priority: str):
+    """
+    Set the priority class of a route for the ConcurrencyLimiter. Critical routes bypass the limit,
+    high routes are taken from the queue first and low routes are shed instead of queued.
+    """
+    def decorator(func: Callable):
+        func._priority = _priority
+        return func
+    return decorator
+
+
+def priority_of(request: Request) -> str:
+    controller = request.attributes.get("_controller")
+    method_name = request.attributes.get("_controller_method")
+    if controller is None or method_name is None:
+        return NORMAL
+    return getattr(getattr(controller, method_name, None), "_priority", NORMAL)
+
+
+class ConcurrencyLimiter:
+    """
+    Limits the requests running their controller at the same time. Requests over the limit wait in a
+    bounded queue and are shed with 503 if it is full or they waited queue_timeout seconds.
+    """
+    _ranks = {HIGH: 0, NORMAL: 1}
+
+    def __init__(self, max_in_flight: int, max_queue: int = 0, queue_timeout: float = 1, retry_after: int = 1):
+        self._max_in_flight = max_in_flight
+        self._max_queue = max_queue
+        self._queue_timeout = queue_timeout
+        self._retry_after = retry_after
+        self._waiters = []
+        self._sequence = itertools.count()
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = 0
+
+    def info(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "shed": self.shed,
+            "max_in_flight": self._max_in_flight,
+            "max_queue": self._max_queue,
+        }
+
+    def _shed(self):
+        self.shed += 1
+        logger(__name__).debug("Shedding request, %d in flight, %d queued", self.in_flight, self.queued)
+        raise HttpException("Service unavailable", 503, headers={"Retry-After": str(self._retry_after)})
+
+    async def acquire(self, _priority: str = NORMAL):
+        if self.in_flight < self._max_in_flight and not self.queued:
+            self.in_flight += 1
+            return
+        if _priority == LOW or self.queued >= self._max_queue:
+            self._shed()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (self._ranks.get(_priority, 1), next(self._sequence), future))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, self._queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before, pass it on
+                self.release()
+            else:
+                self.queued -= 1
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._shed()
+
+    def release(self):
+        """Hand the slot to the first waiting request or free it."""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.queued -= 1
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, _priority: str = NORMAL):
+        if _priority == CRITICAL:
+            yield
+            return
+        await self.acquire(_priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
 class HttpKernel:
     def __init__(
             self,
@@ -82,6 +213,7 @@ class HttpKernel:
 
         self.container = container
         self.is_booted = False
+        self._deferred = set()
 
     async def boot(self):
         if not self.is_booted:
@@ -132,52 +264,86 @@ class HttpKernel:
         if container_builder is not None:
             await container_builder(container)
 
-        request_body = await request.body()
-        logger(__name__).info(f"Handling request {request} - {request_body}")
+        container.set(Request, request)
+        container.set(BackgroundTasks, BackgroundTasks())
+
+        response = await self._handle(request, container)
+        await self.defer(container, lambda: self.terminate(request, response, container))
+        return response
+
+    async def defer(self, container: Container, factory: Callable):
+        """
+        Run the coroutine created by factory after the response has been handed to the bridge, through the
+        CloudContext or else as a task. The coroutine is only created once it is certain to be awaited.
+        """
+        context = None
+        if await container.has(CloudContext):
+            try:
+                context = await container.get(CloudContext)
+            except Exception as e:
+                logger(__name__).error(f"Could not get the CloudContext, deferring to a task: {exception_traceback(e)}")
+        if context is not None:
+            await context.wait_until(factory())
+            return
+
+        # The event loop only keeps weak references to tasks
+        task = asyncio.ensure_future(factory())
+        self._deferred.add(task)
+        task.add_done_callback(self._deferred.discard)
+
+    async def terminate(self, request: Request, response: Response, container: Container):
+        try:
+            await (await container.get(EventDispatcher)).dispatch(TerminateEvent(request, response))
+        except Exception as e:
+            logger(__name__).error(f"Terminate listener failed: {exception_traceback(e)}")
+        await (await container.get(BackgroundTasks)).run()
+
+    async def _handle(self, request: Request, container: Container) -> Response:
+        logger(__name__).debug("Handling request %s", request)
 
         async def dispatch(_):
             await (await container.get(EventDispatcher)).dispatch(_)
 
-        async def log_response(_response: Response):
-            response_body = await _response.body()
-            logger(__name__).info(f"Responding with {_response} - {response_body}")
-
         try:
-            container.set(Request, request)
-
             event = RequestEvent(request)
             await dispatch(event)
 
             if event.response:
-                await log_response(event.response)
-                return event.response
+                response_event = ResponseEvent(request, event.response)
+                await dispatch(response_event)
+                return response_event.response
+
+            if await container.has(ConcurrencyLimiter):
+                limiter = await container.get(ConcurrencyLimiter)
+                async with limiter.slot(priority_of(request)):
+                    return await self._controller(request, container, dispatch)
+            return await self._controller(request, container, dispatch)
+        except Exception as e:
+            exception_event = ExceptionEvent(request, e)
+            await dispatch(exception_event)
+            response = exception_event.response or HttpException(str(e), status_code=500, exception=e).to_response()
+            return response
 
-            controller_event = ControllerEvent(request)
-            await dispatch(controller_event)
+    async def _controller(self, request: Request, container: Container, dispatch: Callable) -> Response:
+        controller_event = ControllerEvent(request)
+        await dispatch(controller_event)
 
-            if not callable(controller_event.controller):
-                raise HttpException('Could not resolve controller', status_code=404)
+        if not callable(controller_event.controller):
+            raise HttpException('Could not resolve controller', status_code=404)
 
-            controller_result = await container.call(
-                controller_event.controller,
-                controller_event.request.attributes
-            )
+        controller_result = await container.call(
+            controller_event.controller,
+            controller_event.request.attributes
+        )
 
-            if not isinstance(controller_result, Response):
-                view_event = ViewEvent(request, controller_result)
-                await dispatch(view_event)
-                if view_event.response is None:
-                    raise RuntimeError('Controller did not return a response object or is not convertable')
-                controller_result = view_event.response
+        if not isinstance(controller_result, Response):
+            view_event = ViewEvent(request, controller_result)
+            await dispatch(view_event)
+            if view_event.response is None:
+                raise RuntimeError('Controller did not return a response object or is not convertable')
+            controller_result = view_event.response
 
-            response_event = ResponseEvent(request, controller_result)
-            await dispatch(response_event)
+        response_event = ResponseEvent(request, controller_result)
+        await dispatch(response_event)
 
-            await log_response(response_event.response)
-            return response_event.response
-        except Exception as e:
-            exception_event = ExceptionEvent(request, e)
-            await dispatch(exception_event)
-            response = exception_event.response or HttpException(str(e), status_code=500, exception=e).to_response()
-            await log_response(response)
-            return response
+        return response_event.response
@@ -1,9 +1,9 @@
 import copy
-import json
 import time
 from typing import Any
 
 from ..sql import Database
+from ..util import json_dumps, json_loads
 
 
 class Store:
@@ -93,7 +93,7 @@ class ExpiringStore(Store):
             return None
 
         try:
-            data = json.loads(raw)
+            data = json_loads(raw)
             expires_at = data.get("expires_at")
             if expires_at and time.time() > expires_at:
                 await self.decorated.delete(key)
@@ -111,7 +111,7 @@ class ExpiringStore(Store):
             "value": value,
             "expires_at": expires_at
         }
-        await self.decorated.put(key, json.dumps(payload))
+        await self.decorated.put(key, json_dumps(payload).decode("utf-8"))
 
     async def delete(self, key: str) -> None:
         await self.decorated.delete(key)
@@ -163,10 +163,10 @@ class JSONStore:
         result = await self.decorated.get(key)
         if result is None:
             return None
-        return json.loads(result)
+        return json_loads(result)
 
     async def put(self, key: str, value: Any) -> None:
-        await self.decorated.put(key, json.dumps(value))
+        await self.decorated.put(key, json_dumps(value).decode("utf-8"))
 
     async def merge(self, key: str, value: dict) -> dict:
         result = await self.get(key)
@@ -150,7 +150,7 @@ class KVQueue(PullQueue):
             if i > self.batch_size:
                 break
             data = await self.store.get(key)
-            logger(__name__).info(f"Pulled message {key} {json.dumps(data)}")
+            logger(__name__).debug("Pulled message %s %s", key, data)
             if data:
                 messages.append(KVMessage(self.store, key, data))
 
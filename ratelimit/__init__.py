@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from ..kv import Store
+from ..util import json_dumps, json_loads, logger
+
+IP = "ip"
+USER = "user"
+ROUTE = "route"
+
+
+def policy(rate: float, burst: int = None, by: str = IP) -> dict:
+    return {
+        "rate": rate,
+        "burst": burst if burst is not None else max(1, int(rate)),
+        "by": by,
+    }
+
+
+def rate_limit(rate: float, burst: int = None, by: str = IP):
+    """
+    Limit a route to rate requests per second with bursts of up to burst requests, per client IP,
+    per user (the identifier of the token, the JWT sub) or for all clients of the route together.
+    """
+    def decorator(func: Callable):
+        func._rate_limit = policy(rate, burst, by)
+        return func
+    return decorator
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "pending", "synced", "syncing")
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.updated = time.time()
+        self.pending = 0
+        self.synced = 0.0
+        self.syncing = False
+
+
+class RateLimiter:
+    """
+    Token buckets kept in this process. With a Store they are synchronized with the buckets of the
+    other instances every sync_interval seconds, so most decisions need no round trip. Between two
+    synchronizations each instance may let through up to rate * sync_interval requests too many.
+    """
+    def __init__(self, max_keys: int = 10000, sync_interval: float = 1):
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._sync_interval = sync_interval
+        self.allowed = 0
+        self.limited = 0
+
+    def _bucket(self, key: str, burst: int) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def consume(self, key: str, rate: float, burst: int) -> float:
+        """Take a token, returns 0 if the request is allowed or else the seconds until it would be."""
+        bucket = self._bucket(key, burst)
+        now = time.time()
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.pending += 1
+            self.allowed += 1
+            return 0
+        self.limited += 1
+        return (1 - bucket.tokens) / rate
+
+    def claim_sync(self, key: str, burst: int) -> Optional[bool]:
+        """
+        Return None if the bucket does not need to be synchronized, otherwise whether it was never
+        synchronized before. The caller must call sync() afterwards.
+        """
+        bucket = self._bucket(key, burst)
+        if bucket.syncing or time.time() - bucket.synced < self._sync_interval:
+            return None
+        bucket.syncing = True
+        return bucket.synced == 0
+
+    async def sync(self, key: str, rate: float, burst: int, store: Store):
+        """Merge the tokens taken here since the last synchronization into the bucket in the store."""
+        bucket = self._bucket(key, burst)
+        pending = bucket.pending
+        bucket.pending = 0
+        try:
+            raw = await store.get(f"ratelimit:{key}")
+            now = time.time()
+            tokens = burst
+            if raw is not None:
+                data = json_loads(raw)
+                tokens = min(burst, data["tokens"] + (now - data["updated"]) * rate)
+            # Other instances may have written in between, the store is not updated atomically
+            tokens = max(0.0, tokens - pending)
+            await store.put(f"ratelimit:{key}", json_dumps({"tokens": tokens, "updated": now}).decode("utf-8"))
+            bucket.tokens = tokens - bucket.pending
+            bucket.updated = now
+            bucket.synced = now
+        except Exception as e:
+            # Retry with the next interval instead of on every request
+            bucket.pending += pending
+            bucket.synced = time.time()
+            logger(__name__).warning(f"Could not synchronize rate limit {key}: {e}")
+        finally:
+            bucket.syncing = False
+
+    def info(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "keys": len(self._buckets),
+        }
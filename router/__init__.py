@@ -1,6 +1,9 @@
 import re
-from typing import Dict, Type, Tuple, Callable, Optional
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Type, Tuple, Callable, Optional
 
+from ..di import TaggedServices
 from ..http import Request
 from ..util import logger
 
@@ -38,40 +41,346 @@ def patch(_route: str):
     return route(_route, "PATCH")
 
 
+def routes_of(cls: Type):
+    """Yield the (route, http method, method name) declarations of a controller class."""
+    for method_name in dir(cls):
+        attr = getattr(cls, method_name)
+        if callable(attr) and hasattr(attr, "_routes"):
+            for _route, http_method in attr._routes:
+                yield _route, http_method, method_name
+
+
+class Converter:
+    """Validates a path parameter while matching and converts it to its Python value."""
+    regex = "[^/]+"
+
+    def to_python(self, value: str) -> Any:
+        return value
+
+
+class IntConverter(Converter):
+    regex = "-?[0-9]+"
+
+    def to_python(self, value: str) -> int:
+        return int(value)
+
+
+class SlugConverter(Converter):
+    regex = "[-a-zA-Z0-9_]+"
+
+
+class UUIDConverter(Converter):
+    regex = "[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+
+    def to_python(self, value: str) -> uuid.UUID:
+        return uuid.UUID(value)
+
+
+class PathConverter(Converter):
+    """Matches the rest of the path including slashes."""
+    regex = ".+"
+
+
+converters = {
+    "str": Converter(),
+    "int": IntConverter(),
+    "slug": SlugConverter(),
+    "uuid": UUIDConverter(),
+    "path": PathConverter(),
+}
+
+_placeholder = re.compile(r"\{(\w+)(?::(\w+))?\}")
+
+
+def _converter(name: str) -> Converter:
+    if name is None:
+        name = "str"
+    if name not in converters:
+        raise ValueError(f"Unknown route parameter type '{name}'")
+    return converters[name]
+
+
+class _Node:
+    __slots__ = ("static", "param", "typed", "patterns", "rest", "route")
+
+    def __init__(self):
+        self.static = {}
+        self.param = None
+        self.typed = {}
+        self.patterns = []
+        self.rest = None
+        self.route = None
+
+
+class _Pattern:
+    """A segment mixing static text and placeholders, like '{name}.json'."""
+    __slots__ = ("regex", "converters")
+
+    def __init__(self, segment: str):
+        parts = []
+        self.converters = []
+        position = 0
+        for match in _placeholder.finditer(segment):
+            converter = _converter(match.group(2))
+            self.converters.append(converter)
+            parts.append(re.escape(segment[position:match.start()]))
+            parts.append(f"({converter.regex})")
+            position = match.end()
+        parts.append(re.escape(segment[position:]))
+        self.regex = re.compile("".join(parts))
+
+
+class RouteTrees:
+    """
+    The compiled trees and match caches of the max_sets most recently used sets of controllers, shared
+    by request scoped routers. A scope registering its own controllers gets its own set. The routers
+    sharing it must use the same table.
+    """
+    def __init__(self, cache_size: int = 0, max_sets: int = 8):
+        self._sets = OrderedDict()
+        self._max_sets = max_sets
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def get(self, controller_ids) -> Optional[tuple]:
+        """Return the trees and the match cache compiled for a set of controllers."""
+        compiled = self._sets.get(controller_ids)
+        if compiled is not None:
+            self._sets.move_to_end(controller_ids)
+        return compiled
+
+    def put(self, controller_ids, trees: Dict[str, _Node]) -> tuple:
+        compiled = self._sets[controller_ids] = (trees, OrderedDict())
+        if len(self._sets) > self._max_sets:
+            self._sets.popitem(last=False)
+        return compiled
+
+    def cache_info(self) -> dict:
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": sum(len(cache) for _, cache in self._sets.values()),
+            "max_size": self.cache_size,
+        }
+
+
 class Router:
-    def __init__(self, controllers: Callable):
+    def __init__(self, controllers: Callable, table=None, cache_size: int = 0, shared: RouteTrees = None):
         self._controllers = controllers
+        self._table = table
+        self._shared = shared if shared is not None else RouteTrees(cache_size)
+        self._compiled = None
+        self._controller_ids = None
+
+    def set_table(self, table):
+        self._table = table
+        self._compiled = None
+
+    def table(self):
+        """Return the (http method, route, controller class, method name) declarations."""
+        if self._table is not None:
+            return self._table
+        return [
+            (http_method, _route, cls, method_name)
+            for cls, _ in self._controllers()
+            for _route, http_method, method_name in routes_of(cls)
+        ]
 
     def routes(self):
-        for cls, _ in self._controllers():
-            for method_name in dir(cls):
-                attr = getattr(cls, method_name)
-                if callable(attr) and hasattr(attr, "_routes"):
-                    for route, http_method in attr._routes:
-                        regex, param_names = self._convert_route_to_regex(route)
-                        yield http_method, regex, cls, method_name, param_names
+        for http_method, _route, cls, method_name in self.table():
+            regex, param_names = self._convert_route_to_regex(_route)
+            yield http_method, regex, cls, method_name, param_names
 
     def _convert_route_to_regex(self, route: str) -> Tuple[re.Pattern, list[str]]:
         """
-        Convert a route like '/user/{id}' to a regex pattern.
+        Convert a route like '/user/{id}' or '/user/{id:int}' to a regex pattern.
         """
-        param_names = re.findall(r"\{(\w+)\}", route)  # Extract placeholder names
-        pattern = re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", route)  # Convert to regex
+        param_names = [name for name, _ in _placeholder.findall(route)]  # Extract placeholder names
+        pattern = _placeholder.sub(lambda m: f"(?P<{m.group(1)}>{_converter(m.group(2)).regex})", route)
         return re.compile(f"^{pattern}$"), param_names
 
-    def match(self, request: Request) -> Optional[Tuple[Type, str, Dict[str, str]]]:
+    def trees(self) -> Dict[str, _Node]:
         """
-        Match the request path against stored routes.
-        Returns the handler function and a dictionary of extracted parameters.
+        Return the routes compiled to one segment tree per HTTP method.
+        The trees are compiled once per set of controllers and shared through RouteTrees.
         """
-        path = request.path
-        for http_method, regex, cls, method_name, param_names in self.routes():
-            logger(__name__).debug(f"Match path {http_method} {path} against {regex}")
-            if request.method != http_method:
+        return self._compiled_trees()[0]
+
+    def _compiled_trees(self) -> tuple:
+        if isinstance(self._controllers, TaggedServices):
+            controller_ids = self._controllers.ids()
+        else:
+            controller_ids = tuple(cls for cls, _ in self._controllers())
+        if self._compiled is None or (
+                controller_ids is not self._controller_ids and controller_ids != self._controller_ids
+        ):
+            compiled = self._shared.get(controller_ids)
+            if compiled is None:
+                compiled = self._shared.put(controller_ids, self._compile())
+            self._compiled = compiled
+            self._controller_ids = controller_ids
+        return self._compiled
+
+    def _compile(self) -> Dict[str, _Node]:
+        trees = {}
+        for http_method, _route, cls, method_name in self.table():
+            node = trees.setdefault(http_method, _Node())
+            for segment in _route.split("/"):
+                node = self._insert(node, segment)
+            # Like the former linear matching, the first declaration of a route wins
+            if node.route is None:
+                node.route = (cls, method_name, [name for name, _ in _placeholder.findall(_route)])
+        return trees
+
+    def _insert(self, node: _Node, segment: str) -> _Node:
+        placeholder = _placeholder.fullmatch(segment)
+        if placeholder is not None:
+            converter = _converter(placeholder.group(2))
+            if isinstance(converter, PathConverter):
+                if node.rest is None:
+                    node.rest = (converter, _Node())
+                return node.rest[1]
+            if type(converter) is Converter:
+                if node.param is None:
+                    node.param = _Node()
+                return node.param
+            if placeholder.group(2) not in node.typed:
+                node.typed[placeholder.group(2)] = (re.compile(converter.regex), converter, _Node())
+            return node.typed[placeholder.group(2)][2]
+
+        if "{" in segment:
+            pattern = _Pattern(segment)
+            for existing, child in node.patterns:
+                if existing.regex.pattern == pattern.regex.pattern:
+                    return child
+            child = _Node()
+            node.patterns.append((pattern, child))
+            return child
+
+        return node.static.setdefault(segment, _Node())
+
+    def _lookup(self, node: _Node, segments: list[str], index: int, values: list):
+        if index == len(segments):
+            return node.route
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            result = self._lookup(child, segments, index + 1, values)
+            if result is not None:
+                return result
+
+        for regex, converter, child in node.typed.values():
+            if not regex.fullmatch(segment):
                 continue
-            match = regex.match(path)
+            try:
+                value = converter.to_python(segment)
+            except ValueError:
+                continue
+            values.append(value)
+            result = self._lookup(child, segments, index + 1, values)
+            if result is not None:
+                return result
+            values.pop()
+
+        for pattern, child in node.patterns:
+            match = pattern.regex.fullmatch(segment)
             if match:
-                logger(__name__).debug(f"Matched route {cls}.{method_name}")
-                params = {name: match.group(name) for name in param_names}
-                return cls, method_name, params
+                try:
+                    converted = [c.to_python(v) for c, v in zip(pattern.converters, match.groups())]
+                except ValueError:
+                    continue
+                size = len(values)
+                values.extend(converted)
+                result = self._lookup(child, segments, index + 1, values)
+                if result is not None:
+                    return result
+                del values[size:]
+
+        if node.param is not None and segment:
+            values.append(segment)
+            result = self._lookup(node.param, segments, index + 1, values)
+            if result is not None:
+                return result
+            values.pop()
+
+        if node.rest is not None:
+            converter, child = node.rest
+            # Shorter matches are tried first, so routes continuing after the path parameter win
+            for end in range(index + 1, len(segments) + 1):
+                value = "/".join(segments[index:end])
+                if not value:
+                    continue
+                values.append(converter.to_python(value))
+                result = self._lookup(child, segments, end, values)
+                if result is not None:
+                    return result
+                values.pop()
+
         return None
+
+    def _match_tree(self, http_method: str, path: str):
+        result = self._match_method(http_method, path)
+        # HEAD is answered by the GET route unless declared, the bridges send no body
+        if result is None and http_method == "HEAD":
+            result = self._match_method("GET", path)
+        return result
+
+    def _match_method(self, http_method: str, path: str):
+        tree = self.trees().get(http_method)
+        if tree is None:
+            return None
+        values = []
+        result = self._lookup(tree, path.split("/"), 0, values)
+        if result is None:
+            return None
+        cls, method_name, param_names = result
+        return cls, method_name, dict(zip(param_names, values))
+
+    def match(self, request: Request) -> Optional[Tuple[Type, str, Dict[str, Any]]]:
+        """
+        Match the request path against stored routes.
+        Returns the handler function and a dictionary of extracted and converted parameters.
+        Static segments take precedence over typed placeholders, mixed segments like
+        '{name}.json', plain placeholders and finally '{name:path}'.
+        """
+        if self._shared.cache_size <= 0:
+            result = self._match_tree(request.method, request.path)
+        else:
+            result = self._match_cached(request.method, request.path)
+        if result is not None:
+            logger(__name__).debug(f"Matched route {result[0]}.{result[1]}")
+        return result
+
+    def _match_cached(self, http_method: str, path: str):
+        # Each set of controllers has its own cache
+        cache = self._compiled_trees()[1]
+        key = (http_method, path)
+        if key in cache:
+            self._shared.cache_hits += 1
+            cache.move_to_end(key)
+            result = cache[key]
+        else:
+            self._shared.cache_misses += 1
+            result = self._match_tree(http_method, path)
+            cache[key] = result
+            if len(cache) > self._shared.cache_size:
+                cache.popitem(last=False)
+        if result is None:
+            return None
+        cls, method_name, params = result
+        return cls, method_name, dict(params)
+
+    def cache_info(self) -> dict:
+        return self._shared.cache_info()
+
+    def allowed_methods(self, request: Request) -> list[str]:
+        """Return the HTTP methods with a route matching the request path, HEAD if GET has one."""
+        allowed = [
+            http_method for http_method in self.trees()
+            if http_method != request.method and self._match_method(http_method, request.path) is not None
+        ]
+        if "GET" in allowed and "HEAD" not in allowed:
+            allowed.append("HEAD")
+        return allowed
@@ -1,5 +1,4 @@
 import datetime
-import json
 from typing import AsyncIterator, Any
 
 from ..util import logger
@@ -9,7 +8,7 @@ class Database:
     """Base database class with basic query and prepared statement functionality."""
     
     async def log(self, _query: str, params: list[Any] = None):
-        logger(__name__).info(f"Executing query: {_query} with params: {json.dumps(params)}")
+        logger(__name__).debug("Executing query: %s with params: %s", _query, params)
 
     def query_in(self, sql: str, args: list[Any]):
         """Expand list arguments into SQL IN clauses with proper placeholders."""
@@ -32,6 +32,9 @@ class CaseInsensitiveDict:
     def __delitem__(self, key):
         del self._store[key.lower()]
 
+    def __contains__(self, key):
+        return key.lower() in self._store
+
     def __iter__(self):
         return (casedkey for casedkey, mappedvalue in self._store.values())
 
@@ -161,6 +164,47 @@ def base64url_decode(data) -> str:
     return base64.urlsafe_b64decode(data + '=='.encode('utf-8')).decode('utf-8')
 
 
+class JsonEncoder:
+    """Serializes JSON with the standard library, see set_json_encoder."""
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value).encode("utf-8")
+
+    def loads(self, data: str|bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonEncoder(JsonEncoder):
+    """Serializes JSON with orjson, which has to be installed. Its output is compact."""
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, value: Any) -> bytes:
+        return self._orjson.dumps(value)
+
+    def loads(self, data: str|bytes) -> Any:
+        return self._orjson.loads(data)
+
+
+_json_encoder = JsonEncoder()
+
+
+def set_json_encoder(encoder: JsonEncoder):
+    """Replace the encoder used for response and request bodies, JSON stores and queue payloads."""
+    global _json_encoder
+    _json_encoder = encoder
+
+
+def json_dumps(value: Any) -> bytes:
+    return _json_encoder.dumps(value)
+
+
+def json_loads(data: str|bytes) -> Any:
+    return _json_encoder.loads(data)
+
+
 def json_base64_decode(data) -> Any:
     return json.loads(base64url_decode(data))
 